@@ -0,0 +1,24 @@
+"""
+基准测试公共启动代码
+插件导入时会在当前目录初始化 game_data.db，并注册 NoneBot 事件处理器，
+因此先切换到临时目录，并以无驱动模式初始化 NoneBot
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def setup() -> Path:
+    """切换到临时工作目录并初始化 NoneBot，返回工作目录"""
+    workdir = Path(tempfile.mkdtemp(prefix="sodache_bench_"))
+    os.chdir(workdir)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+
+    import nonebot
+    nonebot.init(driver="~none")
+    return workdir
@@ -0,0 +1,49 @@
+"""
+游戏日回放基准测试：用手动推进的时钟让一批玩家反复搜索、撤离，回放一整天的游戏时间
+
+用法: python benchmarks/bench_game_day.py [玩家数] [时间步长秒]   （默认 1000 60）
+"""
+
+import sys
+import time
+
+import _bootstrap
+
+_bootstrap.setup()
+
+from plugins.sodache_game import game_core  # noqa: E402
+from plugins.sodache_game.utils.clock import ManualClock  # noqa: E402
+
+DAY = 24 * 3600
+
+
+def main(players: int, step: int) -> None:
+    game_core.persist_queue.stop()
+    clock = ManualClock(1_700_000_000)
+    game_core.set_clock(clock)
+    qqs = [str(200000 + i) for i in range(players)]
+    for qq in qqs:
+        game_core.user_init(qq)
+        game_core.search(qq)
+
+    events = 0
+    start = time.perf_counter()
+    for _ in range(DAY // step):
+        clock.advance(step)
+        events += len(game_core.process_due_events())
+        for qq in qqs:
+            user = game_core.users.peek(qq)
+            if user.status == 0:
+                game_core.search(qq)
+            elif user.status == 1 and user.user_bag_items_nums >= user.backpack_capacity:
+                game_core.retreat(qq)
+    elapsed = time.perf_counter() - start
+
+    gold = sum(game_core.users.peek(qq).gold for qq in qqs)
+    print(f"{players} 名玩家回放 24 小时游戏时间：耗时 {elapsed:.2f} 秒，处理定时事件 {events} 个，"
+          f"结束时哈哈币总量 {gold}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 60)
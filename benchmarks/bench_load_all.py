@@ -0,0 +1,78 @@
+"""
+启动加载基准测试：对比逐用户 N+1 查询与按表顺序扫描的 load_all
+
+用法: python benchmarks/bench_load_all.py [用户数 ...]   （默认 10000 100000）
+"""
+
+import sqlite3
+import sys
+import time
+
+import _bootstrap
+
+WORKDIR = _bootstrap.setup()
+
+from plugins.sodache_game import db  # noqa: E402
+from plugins.sodache_game.equipment_data import all_equipment  # noqa: E402
+from plugins.sodache_game.item_data import all_items  # noqa: E402
+
+ITEMS_PER_USER = 4
+EQUIPMENT_PER_USER = 2
+STORAGE_PER_USER = 3
+
+
+def build_database(path: str, user_count: int) -> None:
+    """生成包含 user_count 个用户的测试数据库"""
+    conn = sqlite3.connect(path)
+    db.init_db(conn=conn)
+    users = []
+    for i in range(user_count):
+        user = db.User(qq=str(100000 + i), gold=i, status=i % 3)
+        user.inventory = [all_items[(i + k) % len(all_items)] for k in range(ITEMS_PER_USER)]
+        user.equipment = [all_equipment[(i + k) % len(all_equipment)] for k in range(EQUIPMENT_PER_USER)]
+        user.equipment_storage = [all_equipment[(i * 7 + k) % len(all_equipment)] for k in range(STORAGE_PER_USER)]
+        users.append(user)
+    db.save_users(users, conn=conn)
+    conn.close()
+
+
+def load_all_n_plus_one(conn: sqlite3.Connection) -> dict:
+    """旧实现：先取出所有 qq，再对每个用户各查询四次（同样记录行id映射）"""
+    users_dict = {}
+    for (qq,) in conn.execute("SELECT qq FROM users").fetchall():
+        user = db.load_user(qq, conn=conn)
+        rows = {"user_items": {}, "user_equipment": {}, "user_equipment_storage": {}}
+        user.inventory = db.load_user_items(qq, conn=conn, row_ids=rows["user_items"])
+        for eq in db.load_user_equipment(qq, conn=conn, row_ids=rows["user_equipment"]):
+            user.equip_item(eq)
+        user.equipment_storage = db.load_user_equipment_storage(qq, conn=conn, row_ids=rows["user_equipment_storage"])
+        user.persisted_rows.update(rows)
+        users_dict[qq] = user
+    return users_dict
+
+
+def timed(fn, path: str):
+    conn = sqlite3.connect(path)
+    try:
+        start = time.perf_counter()
+        result = fn(conn)
+        return time.perf_counter() - start, result
+    finally:
+        conn.close()
+
+
+def main(sizes) -> None:
+    print(f"{'用户数':>8} {'N+1 查询':>12} {'顺序扫描':>12} {'加速比':>8}")
+    for size in sizes:
+        path = str(WORKDIR / f"bench_{size}.db")
+        build_database(path, size)
+        legacy_time, legacy = timed(load_all_n_plus_one, path)
+        bulk_time, bulk = timed(lambda conn: db.load_all(conn=conn), path)
+        assert len(legacy) == len(bulk) == size
+        sample = str(100000 + size // 2)
+        assert [i.id for i in legacy[sample].inventory] == [i.id for i in bulk[sample].inventory]
+        print(f"{size:>8} {legacy_time:>11.2f}s {bulk_time:>11.2f}s {legacy_time / bulk_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
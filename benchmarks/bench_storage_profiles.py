@@ -0,0 +1,47 @@
+"""
+存储配置档基准测试：在各个配置档下逐条执行 save_user + commit，对比每秒提交次数
+
+用法: python benchmarks/bench_storage_profiles.py [提交次数]   （默认 2000）
+"""
+
+import sqlite3
+import sys
+import time
+
+import _bootstrap
+
+WORKDIR = _bootstrap.setup()
+
+from plugins.sodache_game import db  # noqa: E402
+
+
+def run_profile(profile: str, commits: int) -> float:
+    """返回该配置档下的每秒提交次数"""
+    path = str(WORKDIR / f"profile_{profile}.db")
+    conn = sqlite3.connect(path)
+    try:
+        db.apply_storage_profile(conn, profile)
+        db.init_db(conn=conn)
+        users = [db.User(qq=str(100000 + i)) for i in range(100)]
+        start = time.perf_counter()
+        for i in range(commits):
+            user = users[i % len(users)]
+            user.gold += 1
+            db.save_user(user, conn=conn)
+            conn.commit()
+        return commits / (time.perf_counter() - start)
+    finally:
+        conn.close()
+
+
+def main(commits: int) -> None:
+    print(f"{'配置档':<10} {'提交/秒':>10} {'相对 durable':>14}")
+    baseline = None
+    for profile in db.STORAGE_PROFILES:
+        rate = run_profile(profile, commits)
+        baseline = baseline or rate
+        print(f"{profile:<10} {rate:>10.0f} {rate / baseline:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+经济模拟器：用虚拟时钟和模拟玩家直接驱动 game_core，统计哈哈币通胀、物品流向和攻击成功率
+
+不连接 QQ、不写数据库：每个工作进程把 game_core 的时钟换成手动推进的 ManualClock，
+用户只保存在内存中，按群分片后由进程池并行模拟，最后汇总各分片的统计。
+
+用法示例:
+    python economy_simulator.py --players 2000 --hours 72 --workers 8
+    python economy_simulator.py --search-interval 300 --draw-cost 8000 --quality-weights 65,22,9,4
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent
+START_TIME = 1_700_000_000  # 虚拟时钟的起点（时间戳）
+QUALITY_NAMES = {0: "普通", 1: "稀有", 2: "史诗", 3: "传说"}
+SUCCESS_RATE_PATTERN = re.compile(r"成功率为([\d.]+)%")
+
+
+@dataclass(frozen=True)
+class Policy:
+    """模拟玩家的行为策略"""
+    name: str
+    play_chance: float     # 空闲时每个时间步开始搜索的概率
+    patience: int          # 搜索多久（秒）后主动撤离，背包满时立即撤离
+    attack_chance: float   # 搜索中且不在冷却时，每个时间步发起攻击的概率
+    draw_reserve: float    # 哈哈币不少于 抽奖花费 + draw_reserve 时抽装备
+    upgrade_reserve: float  # 哈哈币不少于该值时升级攻击力或防御力
+
+
+POLICIES: Dict[str, Policy] = {
+    "casual": Policy("casual", play_chance=0.05, patience=40 * 60, attack_chance=0.0,
+                     draw_reserve=float("inf"), upgrade_reserve=20000),
+    "raider": Policy("raider", play_chance=0.2, patience=60 * 60, attack_chance=0.5,
+                     draw_reserve=10000, upgrade_reserve=10000),
+    "gambler": Policy("gambler", play_chance=0.1, patience=30 * 60, attack_chance=0.05,
+                      draw_reserve=0, upgrade_reserve=float("inf")),
+}
+
+
+@dataclass
+class SimConfig:
+    players: int
+    groups: int
+    hours: float
+    step: int
+    seed: int
+    mix: Dict[str, float]
+    search_interval: Optional[int] = None
+    retreat_time: Optional[int] = None
+    draw_cost: Optional[int] = None
+    quality_weights: Optional[Tuple[int, ...]] = None
+
+
+class NullQueue:
+    """代替写回队列：模拟时不写数据库"""
+
+    def mark_dirty(self, user) -> None:
+        pass
+
+    def is_dirty(self, qq: str) -> bool:
+        return False
+
+    def flush(self) -> int:
+        return 0
+
+    def stop(self) -> None:
+        pass
+
+
+class MemoryStore(dict):
+    """代替 UserCache：所有用户常驻内存，没有淘汰和大小估算"""
+
+    def peek(self, qq: str):
+        return dict.get(self, qq)
+
+
+class CountingSampler:
+    """包装物品掉落抽样器，统计每个品质掉落的数量和价值"""
+
+    def __init__(self, sampler, stats: "ShardStats"):
+        self.sampler = sampler
+        self.stats = stats
+
+    def sample_many(self, k: int):
+        items = self.sampler.sample_many(k)
+        for item in items:
+            self.stats.drops[item.quality] += 1
+            self.stats.drop_value[item.quality] += item.value
+        return items
+
+
+class ShardStats:
+    """单个分片的统计数据，可以逐项相加"""
+
+    def __init__(self):
+        self.actions = 0
+        self.drops: Counter = Counter()         # 品质 -> 掉落件数
+        self.drop_value: Counter = Counter()    # 品质 -> 掉落价值
+        self.gold_flow: Counter = Counter()     # 来源/去向 -> 哈哈币数量（正为流入，负为流出）
+        self.attack_results: Counter = Counter()  # 攻击结果 -> 次数
+        self.rate_buckets: Counter = Counter()    # (成功率区间, 是否打赢) -> 次数
+        self.money_supply: List[int] = []         # 每个游戏小时结束时的哈哈币总量
+        self.final_gold: List[int] = []
+
+    def merge(self, other: "ShardStats") -> None:
+        self.actions += other.actions
+        for name in ("drops", "drop_value", "gold_flow", "attack_results", "rate_buckets"):
+            getattr(self, name).update(getattr(other, name))
+        if len(other.money_supply) > len(self.money_supply):
+            self.money_supply.extend([0] * (len(other.money_supply) - len(self.money_supply)))
+        for hour, total in enumerate(other.money_supply):
+            self.money_supply[hour] += total
+        self.final_gold.extend(other.final_gold)
+
+
+_game_core = None
+
+
+def _load_game_core():
+    """在工作进程中初始化 NoneBot（无驱动）并导入 game_core，每个进程只执行一次"""
+    global _game_core
+    if _game_core is None:
+        # 导入插件时会在当前目录创建数据库，切换到临时目录避免污染工作目录
+        os.chdir(tempfile.mkdtemp(prefix="sodache_sim_"))
+        sys.path.insert(0, str(ROOT))
+        import nonebot
+        nonebot.init(driver="~none")
+        from plugins.sodache_game import game_core
+        game_core.persist_queue.stop()
+        _game_core = game_core
+    return _game_core
+
+
+def _reset_game_core(gc, config: SimConfig, clock, stats: ShardStats) -> None:
+    """替换时钟、存储和索引，并应用调参覆盖值"""
+    from plugins.sodache_game.utils.session_index import SessionIndex
+    from plugins.sodache_game.utils.scheduler import EventScheduler
+    from plugins.sodache_game.utils.player_columns import PlayerColumns
+    from plugins.sodache_game.utils.leaderboard import GoldLeaderboard
+    from plugins.sodache_game.utils.target_index import TargetIndex
+
+    gc.set_clock(clock)
+    gc.persist_queue = NullQueue()
+    gc.users = MemoryStore()
+    gc.sessions = SessionIndex()
+    gc.scheduler = EventScheduler()
+    gc.player_columns = PlayerColumns()
+    gc.leaderboard = GoldLeaderboard()
+    gc.targets = TargetIndex()
+    gc.retreat_listeners.clear()
+    gc.add_retreat_listener(lambda user, value: stats.gold_flow.update({"撤离带出": value}))
+
+    if config.search_interval is not None:
+        gc.search_base_interval = config.search_interval
+    if config.retreat_time is not None:
+        gc.retreat_base_time = config.retreat_time
+    if config.draw_cost is not None:
+        gc.equipment_draw_cost = config.draw_cost
+    if config.quality_weights is not None:
+        gc.item_quality_weights = dict(enumerate(config.quality_weights))
+    gc.rebuild_drop_tables()
+    gc.item_drop_sampler = CountingSampler(gc.item_drop_sampler, stats)
+
+
+def _assign_policies(count: int, mix: Dict[str, float], rng: random.Random) -> List[Policy]:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    return [POLICIES[name] for name in rng.choices(names, weights, k=count)]
+
+
+def _record_attack(stats: ShardStats, result: str) -> None:
+    if result.startswith("打赢了"):
+        outcome = "打赢"
+    elif result.startswith("没打过"):
+        outcome = "没打过"
+    elif result.startswith("冷却中"):
+        outcome = "冷却中"
+    elif "保护" in result:
+        outcome = "目标受保护"
+    else:
+        outcome = "无效攻击"
+    stats.attack_results[outcome] += 1
+    match = SUCCESS_RATE_PATTERN.search(result)
+    if match:
+        bucket = min(9, int(float(match.group(1)) // 10))
+        stats.rate_buckets[(bucket, outcome == "打赢")] += 1
+
+
+def _act(gc, qq: str, group: str, policy: Policy, stats: ShardStats, rng: random.Random) -> None:
+    """按策略为一个玩家执行一个时间步内的操作"""
+    user = gc.users[qq]
+    now = gc.now()
+
+    if user.status == 0:
+        if rng.random() >= policy.play_chance:
+            return
+        # 开始搜索前先花钱：抽装备、升级属性
+        if user.gold >= gc.equipment_draw_cost + policy.draw_reserve:
+            before = user.gold
+            ok, _, eq = gc.draw_equipment_for_purchase(qq)
+            stats.actions += 1
+            stats.gold_flow["抽装备花费"] += user.gold - before
+            # 有空位且不重复时装备，否则直接出售
+            if ok and eq is not None and not (len(user.equipment) < 4 and user.equip_item(eq)):
+                user.gold += eq.value
+                stats.gold_flow["出售装备"] += eq.value
+        if user.gold >= policy.upgrade_reserve:
+            before = user.gold
+            gc.upgrade_attribute(qq, rng.choice((1, 2)), 1)
+            stats.actions += 1
+            stats.gold_flow["升级花费"] += user.gold - before
+        gc.search(qq, group)
+        stats.actions += 1
+        return
+
+    if user.status != 1:
+        return  # 撤离中，等待定时事件结算
+
+    if (user.user_bag_items_nums >= user.backpack_capacity
+            or now - user.search_start_time >= policy.patience):
+        gc.retreat(qq)
+        stats.actions += 1
+        return
+
+    if (policy.attack_chance and now >= user.attack_cooldown_end_time
+            and rng.random() < policy.attack_chance):
+        targets = gc.get_active_users(group=group)
+        if len(targets) > 1:
+            target = rng.choice(targets)
+            if target != qq:
+                before = user.gold
+                _record_attack(stats, gc.attack(qq, target))
+                stats.actions += 1
+                stats.gold_flow["攻击损失"] += user.gold - before
+
+
+def run_shard(args: Tuple[int, int, SimConfig]) -> Tuple[ShardStats, float]:
+    """模拟一个分片（若干个群），返回统计数据和耗时"""
+    shard, player_count, config = args
+    started = time.perf_counter()
+    gc = _load_game_core()
+    from plugins.sodache_game.utils.clock import ManualClock
+    stats = ShardStats()
+    clock = ManualClock(START_TIME)
+    _reset_game_core(gc, config, clock, stats)
+
+    seed = config.seed * 1_000_003 + shard
+    rng = random.Random(seed)
+    random.seed(seed)  # game_core 使用全局 random
+
+    groups_in_shard = max(1, config.groups * player_count // max(1, config.players))
+    players = []
+    for i, policy in enumerate(_assign_policies(player_count, config.mix, rng)):
+        qq = f"{shard}_{i}"
+        gc.user_init(qq)
+        players.append((qq, f"{shard}_g{i % groups_in_shard}", policy))
+    stats.gold_flow["初始哈哈币"] += sum(gc.users[qq].gold for qq, _, _ in players)
+
+    steps = int(config.hours * 3600 // config.step)
+    next_sample = START_TIME + 3600
+    for _ in range(steps):
+        current = clock.advance(config.step)
+        stats.actions += len(gc.process_due_events(current))
+        for qq, group, policy in players:
+            _act(gc, qq, group, policy, stats, rng)
+        if current >= next_sample:
+            stats.money_supply.append(sum(gc.users[qq].gold for qq, _, _ in players))
+            next_sample += 3600
+
+    stats.final_gold = [gc.users[qq].gold for qq, _, _ in players]
+    return stats, time.perf_counter() - started
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def report(config: SimConfig, stats: ShardStats, wall: float) -> None:
+    print(f"玩家 {config.players}，群 {config.groups}，模拟 {config.hours:g} 小时（步长 {config.step} 秒）")
+    print(f"共执行 {stats.actions} 次操作，耗时 {wall:.1f} 秒，约 {stats.actions / wall * 60:,.0f} 次/分钟\n")
+
+    initial = stats.gold_flow["初始哈哈币"]
+    final = sum(stats.final_gold)
+    print("== 哈哈币 ==")
+    print(f"初始总量 {initial:,}，结束总量 {final:,}，通胀倍数 {final / initial if initial else 0:.2f}x")
+    for name in ("撤离带出", "出售装备", "抽装备花费", "升级花费", "攻击损失"):
+        print(f"  {name:<8} {stats.gold_flow[name]:>+16,}")
+    gold = sorted(stats.final_gold)
+    print(f"  玩家哈哈币分布 p10={_percentile(gold, 0.1):,} p50={_percentile(gold, 0.5):,} "
+          f"p90={_percentile(gold, 0.9):,} 最高={gold[-1] if gold else 0:,}")
+    if stats.money_supply:
+        hours = len(stats.money_supply)
+        marks = sorted({0, hours // 4, hours // 2, 3 * hours // 4, hours - 1})
+        print("  货币总量: " + "，".join(f"第{h + 1}小时 {stats.money_supply[h]:,}" for h in marks))
+
+    print("\n== 物品掉落 ==")
+    total_drops = sum(stats.drops.values())
+    for quality, name in QUALITY_NAMES.items():
+        count = stats.drops[quality]
+        share = count / total_drops * 100 if total_drops else 0
+        print(f"  {name} {count:>10,} 件 ({share:5.1f}%)  价值 {stats.drop_value[quality]:>14,}")
+
+    print("\n== 攻击 ==")
+    attempts = sum(stats.attack_results.values())
+    for outcome, count in stats.attack_results.most_common():
+        print(f"  {outcome:<6} {count:>10,} ({count / attempts * 100:5.1f}%)")
+    print("  成功率区间   交战次数   实际胜率")
+    for bucket in range(10):
+        wins = stats.rate_buckets[(bucket, True)]
+        fights = wins + stats.rate_buckets[(bucket, False)]
+        if fights:
+            print(f"  {bucket * 10:>3}-{bucket * 10 + 10:<3}%   {fights:>8,}   {wins / fights * 100:6.1f}%")
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in POLICIES:
+            raise argparse.ArgumentTypeError(f"未知策略 {name}，可选：{', '.join(POLICIES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="搜打撤经济模拟器")
+    parser.add_argument("--players", type=int, default=1000, help="模拟玩家数（默认1000）")
+    parser.add_argument("--groups", type=int, default=20, help="群数量，攻击只发生在同一群内（默认20）")
+    parser.add_argument("--hours", type=float, default=24, help="模拟的游戏时长（小时，默认24）")
+    parser.add_argument("--step", type=int, default=60, help="时间步长（秒，默认60）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--shards", type=int, default=None, help="分片数，默认等于工作进程数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("casual=0.5,raider=0.3,gambler=0.2"),
+                        help="策略比例，如 casual=0.5,raider=0.3,gambler=0.2")
+    parser.add_argument("--search-interval", type=int, help="覆盖基础搜索间隔（秒）")
+    parser.add_argument("--retreat-time", type=int, help="覆盖基础撤离时间（秒）")
+    parser.add_argument("--draw-cost", type=int, help="覆盖起装抽奖花费")
+    parser.add_argument("--quality-weights", type=lambda s: tuple(int(w) for w in s.split(",")),
+                        help="覆盖搜索掉落的品质权重，如 60,25,10,5")
+    args = parser.parse_args(argv)
+
+    config = SimConfig(
+        players=args.players, groups=max(1, args.groups), hours=args.hours, step=args.step, seed=args.seed,
+        mix=args.mix, search_interval=args.search_interval, retreat_time=args.retreat_time,
+        draw_cost=args.draw_cost, quality_weights=args.quality_weights,
+    )
+    shards = max(1, min(args.shards or args.workers, args.players))
+    sizes = [args.players // shards + (1 if i < args.players % shards else 0) for i in range(shards)]
+
+    started = time.perf_counter()
+    total = ShardStats()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for stats, _ in pool.map(run_shard, [(i, size, config) for i, size in enumerate(sizes)]):
+            total.merge(stats)
+    report(config, total, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
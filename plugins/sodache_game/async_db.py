@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步数据访问层
+所有查询都在一个专用线程中执行，该线程持有自己的数据库连接；
+NoneBot 事件处理器 await 返回的协程即可，慢提交或等待数据库锁都不会阻塞事件循环。
+这里只负责读取：用户数据的写入统一由 game_core 的写回队列（WriteBehindQueue）完成
+"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from . import db
+from .models.game_models import User
+
+
+class AsyncDatabase:
+    """db 模块的异步封装：单线程执行器 + 线程独占连接"""
+
+    def __init__(self, db_path: str = db.db_path, timeout: int = db.db_timeout, profile: str = db.storage_profile):
+        """
+        参数:
+        - db_path: 数据库文件路径
+        - timeout: 数据库操作超时时间（秒）
+        - profile: 连接使用的存储配置档，见 db.STORAGE_PROFILES
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self.profile = profile
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None  # 只在执行器线程中访问
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sodache-db")
+        return self._executor
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            db.apply_storage_profile(self._conn, self.profile)
+        return self._conn
+
+    def _call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        # 在执行器线程中运行：使用线程自己的连接，成功提交，失败回滚
+        conn = self._get_conn()
+        try:
+            result = fn(*args, conn=conn, **kwargs)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _close_conn(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在数据库线程中调用接受 conn 参数的 db 函数，例如 run(db.load_user, qq)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(self._call, fn, *args, **kwargs))
+
+    async def load_user(self, qq: str) -> Optional[User]:
+        """加载单个用户及其物品、装备和装备仓库，用户不存在时返回 None"""
+        return await self.run(db.load_user_full, qq)
+
+    async def close(self) -> None:
+        """关闭数据库线程的连接并停止执行器"""
+        if self._executor is None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close_conn)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+
+async_db = AsyncDatabase()
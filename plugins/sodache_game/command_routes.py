@@ -5,22 +5,86 @@
 负责定义游戏命令关键词与对应的处理函数映射
 """
 
-from nonebot import on_command, on_message, get_driver
+import asyncio
+import time
+from typing import List, Optional
+from nonebot import on_command, on_message, get_driver, get_bot, logger
 from nonebot.rule import to_me, Rule
 from nonebot.adapters.onebot.v11 import Bot, Event
-from .game_core import search, retreat, attack, user_init, check_status,check_retreat_status,users,stop_retreat,get_actual_retreat_time,upgrade_attribute, draw_equipment_for_purchase, format_equipment_attributes, get_actual_retreat_time, get_player_stats
-from nonebot.adapters.onebot.v11 import MessageSegment
+from .game_core import search_async, retreat_async, attack_async, get_attack_targets_async, check_status_async, check_retreat_status_async, stop_retreat_async, upgrade_attribute_async, draw_equipment_for_purchase_async, draw_equipment_batch_for_purchase_async, get_user_async, get_or_init_user_async, get_actual_retreat_time, format_equipment_attributes, get_player_stats, mark_dirty, persist_queue, run_scheduler, add_retreat_listener, user_locks, equipment_draw_cost, get_search_interval, now, get_economy_summary, leaderboard, equipment_storage_capacity, equipment_multi_draw_count, take_retreat_report
+from .async_db import async_db
+from .utils.notifier import GroupNotifier, Notice
+from nonebot.adapters.onebot.v11 import Message, MessageSegment
 from nonebot.params import ArgPlainText
-from .db import save_user
 from nonebot.rule import Rule
 from nonebot.typing import T_State
-import time
 from .models.game_models import EquipmentType
-from .db import save_user, save_user_equipment, save_user_equipment_storage
 
 quality_map = {0: "普通", 1: "稀有", 2: "史诗", 3: "传说"}
 equipment_type_map = {0: "武器", 1: "防具", 2: "背包", 3: "饰品", 99: "其他"}
 claimed_compensation = set()
+driver = get_driver()
+scheduler_task: Optional[asyncio.Task] = None
+
+def _retreat_report_text(qq: str) -> str:
+    """尚未告知玩家的撤离结算（多为后台定时任务完成的撤离），取出后不再重复显示"""
+    report = take_retreat_report(qq)
+    if report is None:
+        return ""
+    total_value, finished_at = report
+    return f"撤离成功！（{time.strftime('%H:%M', time.localtime(finished_at))}完成）本次撤离带出物品价值：{total_value}哈哈币\n"
+
+def _storage_index(user, eq) -> int:
+    """按对象（而不是相等性）查找装备在仓库中的位置，找不到返回 -1"""
+    for i, stored in enumerate(user.equipment_storage):
+        if stored is eq:
+            return i
+    return -1
+
+# 撤离完成后主动在群里通知（默认关闭），在 .env 中设置 SODACHE_RETREAT_NOTIFY=true 开启；
+# 同一群在 SODACHE_NOTIFY_BATCH_WINDOW 秒内完成撤离的玩家合并为一条消息
+retreat_notify = bool(getattr(driver.config, "sodache_retreat_notify", False))
+notify_batch_window = float(getattr(driver.config, "sodache_notify_batch_window", 2.0))
+
+async def _send_group_notices(group: str, notices: List[Notice]):
+    msg = Message()
+    for i, (qq, text) in enumerate(notices):
+        if i:
+            msg += "\n"
+        msg += MessageSegment.at(qq)
+        msg += f" {text}"
+    try:
+        bot = get_bot()
+    except ValueError:
+        logger.warning(f"没有可用的 Bot，丢弃群 {group} 的 {len(notices)} 条撤离通知")
+        return
+    await bot.send_group_msg(group_id=int(group), message=msg)
+
+retreat_notifier = GroupNotifier(_send_group_notices, notify_batch_window)
+
+def _on_retreat_finished(user, total_value: int):
+    # 私聊中开始的搜索没有群号，不发送通知
+    if user.search_group:
+        retreat_notifier.add(user.search_group, user.qq, f"撤离成功！本次撤离带出物品价值：{total_value}哈哈币")
+
+if retreat_notify:
+    add_retreat_listener(_on_retreat_finished)
+
+@driver.on_startup
+async def _start_scheduler():
+    """启动处理物品掉落、撤离完成等定时事件的后台任务，并为撤离通知绑定事件循环"""
+    global scheduler_task
+    retreat_notifier.start()
+    scheduler_task = asyncio.create_task(run_scheduler())
+
+@driver.on_shutdown
+async def _flush_on_shutdown():
+    """关闭时停止定时事件任务和后台写回线程，并同步写入剩余的用户数据"""
+    if scheduler_task is not None:
+        scheduler_task.cancel()
+    retreat_notifier.cancel()
+    persist_queue.stop()
+    await async_db.close()
 
 # 创建精确匹配的规则
 def is_exact_command(cmd: str) -> Rule:
@@ -44,8 +108,10 @@ async def _search_handler(bot: Bot, event: Event):
     """
     qq = event.get_user_id()
     # try:
-    success = search(qq)
+    group_id = str(getattr(event, "group_id", "") or "")
+    success = await search_async(qq, group_id)
     msg = MessageSegment.at(qq)+"\n"
+    msg += _retreat_report_text(qq)
     if success:
         msg+=f"搜索开始!"
         await search_cmd.finish(msg)
@@ -86,11 +152,40 @@ async def _attack_handler(bot: Bot, event: Event):
     attacker_qq = event.get_user_id()
     defender_qq = target_qq
     msg = MessageSegment.at(attacker_qq)+"\n"
-    success = attack(attacker_qq, defender_qq)
+    success = await attack_async(attacker_qq, defender_qq)
     if success:
         msg += success
         await attack_cmd.finish(msg)
 
+# 找目标命令：列出本群当前可以攻击的玩家
+attack_target_limit = 10  # 最多列出的目标数
+find_target_cmd = on_command("找目标", rule=is_exact_command("找目标"), priority=10)
+@find_target_cmd.handle()
+async def _find_target_handler(bot: Bot, event: Event):
+    """
+    处理找目标命令
+    """
+    qq = event.get_user_id()
+    group_id = str(getattr(event, "group_id", "") or "")
+    msg = MessageSegment.at(qq) + "\n"
+    if not group_id:
+        await find_target_cmd.finish(msg + "请在群聊中使用找目标")
+
+    found = await get_attack_targets_async(qq, group_id)
+    user = await get_user_async(qq)
+    if user is None or user.status != 1:
+        msg += "你未在搜索状态，开始搜索后才能攻击\n"
+    elif now() < user.attack_cooldown_end_time:
+        msg += f"攻击冷却中，{user.attack_cooldown_end_time - now()}秒后可再次攻击\n"
+    if not found:
+        await find_target_cmd.finish(msg + "本群暂时没有可以攻击的目标")
+
+    msg += f"本群可攻击目标（共{len(found)}人）："
+    for target_qq, rate, bag_items in found[:attack_target_limit]:
+        msg += f"\n{target_qq} 成功率{rate * 100:.2f}% 背包{bag_items}件"
+    msg += "\n发送“打 QQ号”进行攻击"
+    await find_target_cmd.finish(msg)
+
 # 撤离命令
 retreat_cmd = on_command("撤", rule=is_exact_command("撤"), priority=10)
 @retreat_cmd.handle()
@@ -99,8 +194,8 @@ async def _retreat_handler(bot: Bot, event: Event):
     处理撤离命令
     """
     qq = event.get_user_id()
-    user = users.get(qq)
-    success = retreat(qq)
+    user = await get_user_async(qq)
+    success = await retreat_async(qq)
     msg = MessageSegment.at(qq)+"\n"
     actual_retreat_time = get_actual_retreat_time(user)
     if success:
@@ -124,34 +219,28 @@ async def _status_handler(bot: Bot, event: Event):
     处理状态查询命令
     """
     qq = event.get_user_id()
-    total_value = check_retreat_status(qq)
-    status_info = check_status(qq)
-    user = users.get(qq)
+    await check_retreat_status_async(qq)
+    status_info = await check_status_async(qq)
+    user = await get_user_async(qq)
     stats = get_player_stats(user) if user else None
     # 构建回复消息
     msg = MessageSegment.at(qq)+"\n"
+    msg += _retreat_report_text(qq)
     msg += f"当前状态：{status_info['status_text']}\n"
     if(status_info['status']==1):
         msg+=f"攻击力：{int(user.attack)}+{int(stats.attack)-int(user.attack)}，防御力：{int(user.defense)}+{int(stats.defense)-int(user.defense)}\n"
-        # 与抽取逻辑一致的实际间隔：基础360秒，受"搜索时长（search_time）"影响
-        # 搜索时长为正数：增加间隔（减慢），为负数：减少间隔（加快）
-        base_interval = 360
-        actual_interval = base_interval + int(stats.search_time)
-        # 限制范围保持一致：50~1800 秒
-        actual_interval = max(50, min(1800, actual_interval))
-        elapsed = int(time.time()) - user.search_start_time
+        # 与抽取逻辑一致的实际间隔（包含"搜索时长（search_time）"加成）
+        actual_interval = int(get_search_interval(user))
+        elapsed = now() - user.search_start_time
         rem = elapsed % actual_interval
         remaining_time = actual_interval - rem if rem != 0 else actual_interval
         msg+=f"（距离获得下一件物品还剩{remaining_time}秒）\n"
     elif(status_info['status']==2):
         actual_retreat_time = get_actual_retreat_time(user)
-        remaining_time = actual_retreat_time - (int(time.time()) - user.retreat_start_time)
-        if remaining_time <= 0:
-            msg+=f"本次撤离带出物品价值：{total_value}哈哈币\n"
-            msg+=f"撤离成功！\n"
-        else:
-            msg+=f"攻击力：{int(user.attack)}+{int(stats.attack)-int(user.attack)}，防御力：{int(user.defense)}+{int(stats.defense)-int(user.defense)}\n"
-            msg+=f"（距离撤离完成还剩{remaining_time}秒，总撤离时间：{actual_retreat_time}秒）\n"
+        remaining_time = actual_retreat_time - (now() - user.retreat_start_time)
+        # 到时间的撤离已在上面结算并转为空闲，这里一定还没完成
+        msg+=f"攻击力：{int(user.attack)}+{int(stats.attack)-int(user.attack)}，防御力：{int(user.defense)}+{int(stats.defense)-int(user.defense)}\n"
+        msg+=f"（距离撤离完成还剩{remaining_time}秒，总撤离时间：{actual_retreat_time}秒）\n"
     elif(status_info['status']==0):
         msg+=f"攻击力：{int(user.attack)}+{int(stats.attack)-int(user.attack)}，防御力：{int(user.defense)}+{int(stats.defense)-int(user.defense)}\n"
         msg+=f"哈哈币：{status_info['gold']}"
@@ -172,7 +261,7 @@ async def _stop_retreat_handler(bot: Bot, event: Event):
     处理取消撤离命令
     """
     qq = event.get_user_id()
-    success = stop_retreat(qq)
+    success = await stop_retreat_async(qq)
     msg = MessageSegment.at(qq)+"\n"
     if success:
         msg += "撤离已取消！"
@@ -188,9 +277,7 @@ async def _train_handler(bot: Bot, event: Event):
     处理锻体升级命令 - 第一阶段：选择要升级的属性
     """
     qq = event.get_user_id()
-    user = users.get(qq)
-    if not user:
-        user = user_init(qq)
+    user = await get_or_init_user_async(qq)
     
     # 构建属性选择菜单
     msg = MessageSegment.at(qq) + "\n"
@@ -231,8 +318,8 @@ async def _receive_attribute_choice(bot: Bot, event: Event,state: T_State):
     
     # 对于背包容量(4)，直接升级
     if attribute_choice == 4:
-        success, msg = upgrade_attribute(qq, attribute_choice, 1)
-        user = users.get(qq)
+        success, msg = await upgrade_attribute_async(qq, attribute_choice, 1)
+        user = await get_user_async(qq)
         response = MessageSegment.at(qq) + "\n"
         if success:
             response += f"背包容量升级成功！当前容量：{user.backpack_capacity}\n"
@@ -261,8 +348,8 @@ async def _receive_upgrade_amount(bot: Bot, event: Event,state: T_State):
         await train_cmd.finish("输入错误")
     
     # 执行升级
-    success, msg = upgrade_attribute(qq, attribute_choice, amount)
-    user = users.get(qq)
+    success, msg = await upgrade_attribute_async(qq, attribute_choice, amount)
+    user = await get_user_async(qq)
     response = MessageSegment.at(qq) + "\n"
     
     attribute_names = {1: "攻击力", 2: "防御力", 3: "撤离速度"}
@@ -317,42 +404,87 @@ async def _buchang_handler(bot: Bot, event: Event):
     
     # 检查是否是管理员操作
     if qq != "815953227":
-        user = users.get(qq)
-        user.gold -= 100
-        save_user(user)
+        user = await get_user_async(qq)
+        with user_locks.hold(qq):
+            user.gold -= 100
+            mark_dirty(user)
         await buchang_cmd.finish(MessageSegment.at(qq) + "\n僭越之罪，扣100哈哈币")
 
     # 获取并更新目标用户的哈哈币
-    target_user = users.get(target_qq)
-    if not target_user:
-        target_user = user_init(target_qq)
+    target_user = await get_or_init_user_async(target_qq)
     
-    target_user.gold += amount
-    save_user(target_user)
+    with user_locks.hold(target_qq):
+        target_user.gold += amount
+        mark_dirty(target_user)
     
     # 发送成功消息
     msg = MessageSegment.at(target_qq) + "\n"
     msg += f"获得{amount}哈哈币！当前哈哈币：{target_user.gold}"
     await buchang_cmd.finish(msg)
 
+# 哈哈币排行榜：群聊中显示本群排行（按最近一次搜索所在的群），私聊中显示全服排行
+leaderboard_size = 10  # 排行榜显示的人数
+leaderboard_cmd = on_command("排行榜", rule=is_exact_command("排行榜"), priority=10)
+@leaderboard_cmd.handle()
+async def _leaderboard_handler(bot: Bot, event: Event):
+    qq = event.get_user_id()
+    group_id = str(getattr(event, "group_id", "") or "") or None
+    top = leaderboard.top(leaderboard_size, group_id)
+    msg = MessageSegment.at(qq) + "\n"
+    msg += f"{'本群' if group_id else '全服'}哈哈币排行榜（共{leaderboard.size(group_id)}人）："
+    if not top:
+        msg += "\n暂无数据，发送“搜”开始游戏"
+    for i, (top_qq, gold) in enumerate(top, 1):
+        msg += f"\n{i}. {top_qq} {gold}哈哈币"
+
+    my_global_rank = leaderboard.rank(qq)
+    if my_global_rank is None:
+        await leaderboard_cmd.finish(msg)
+    if group_id:
+        my_group_rank = leaderboard.rank(qq, group_id)
+        msg += f"\n你的本群排名：{my_group_rank if my_group_rank is not None else '未上榜'}"
+    msg += f"\n你的全服排名：{my_global_rank}/{leaderboard.size()}"
+    await leaderboard_cmd.finish(msg)
+
+# 经济报告（管理员）：全服哈哈币、破产人数、状态和属性分布
+economy_report_cmd = on_command("经济报告", rule=is_exact_command("经济报告"), priority=10)
+@economy_report_cmd.handle()
+async def _economy_report_handler(bot: Bot, event: Event):
+    qq = event.get_user_id()
+    if qq != "815953227":
+        await economy_report_cmd.finish(MessageSegment.at(qq) + "\n只有管理员可以查看经济报告")
+
+    summary = get_economy_summary()
+    status = summary["status"]
+    msg = f"玩家数：{summary['players']}\n"
+    msg += f"哈哈币总量：{summary['total_gold']}\n"
+    msg += f"破产人数：{summary['broke']}\n"
+    msg += f"空闲/搜索中/撤离中：{status[0]}/{status[1]}/{status[2]}\n"
+    for key, name in (("attack", "攻击力"), ("defense", "防御力"), ("speed", "速度"), ("backpack_capacity", "背包容量")):
+        _, low, high, mean = summary[key]
+        msg += f"{name}：最低{low} 最高{high} 平均{mean:.1f}\n"
+    labels = ("<0", "0-5000", "5000-2万", "2万-10万", "≥10万")
+    msg += "哈哈币分布：" + " ".join(f"{label}:{count}" for label, count in zip(labels, summary["gold_distribution"]))
+    if summary["top_gold"]:
+        msg += "\n哈哈币最多：" + "、".join(f"{top_qq}({gold})" for top_qq, gold in summary["top_gold"])
+    await economy_report_cmd.finish(msg)
+
 # 起装命令：启动抽奖交互
 equip_start_cmd = on_command("起装", rule=is_exact_command("起装"), priority=10)
 @equip_start_cmd.handle()
 async def _equip_start(event: Event):
     qq = event.get_user_id()
-    check_retreat_status(qq)
-    user = users.get(qq)
-    if not user:
-        user = user_init(qq)
+    await check_retreat_status_async(qq)
+    user = await get_or_init_user_async(qq)
     if user.status != 0:
         await equip_start_cmd.finish(MessageSegment.at(qq) + "\n你不在空闲状态，不能起装！")
-    if len(user.equipment_storage) >= 10:
+    if len(user.equipment_storage) >= equipment_storage_capacity:
         await equip_start_cmd.finish(MessageSegment.at(qq) + "\n装备仓库已满，无法起装，请先整理仓库！")
     prompt = (
         MessageSegment.at(qq) + "\n"
         + "请选择：\n"
         + "0. 我后悔了，不抽了\n"
-        + "1. 在标准装备池中随机抽取一件装备（5000哈哈币）"
+        + f"1. 在标准装备池中随机抽取一件装备（{equipment_draw_cost}哈哈币）"
     )
     await equip_start_cmd.send(prompt)
 
@@ -367,15 +499,15 @@ async def _handle_equipment_pool_choice(event: Event, selection: str = ArgPlainT
     if choice == 0:
         await equip_start_cmd.finish(MessageSegment.at(qq)+"\n已取消抽奖。")
     # 抽取装备
-    success, msg, new_eq = draw_equipment_for_purchase(qq)
+    success, msg, new_eq = await draw_equipment_for_purchase_async(qq)
     if not success or new_eq is None:
         await equip_start_cmd.finish(MessageSegment.at(qq)+"\n"+msg)
     
     # 直接将装备存入仓库
-    user = users.get(qq)
-    user.equipment_storage.append(new_eq)
-    save_user(user)
-    save_user_equipment_storage(qq, user.equipment_storage)
+    user = await get_user_async(qq)
+    with user_locks.hold(qq):
+        user.equipment_storage.append(new_eq)
+        mark_dirty(user)
     
     # 将装备信息存入 state，NoneBot2 会自动管理
     from nonebot.matcher import current_matcher
@@ -389,7 +521,7 @@ async def _handle_equipment_pool_choice(event: Event, selection: str = ArgPlainT
 @equip_start_cmd.got("store_or_sell")
 async def _handle_equipment_store_or_sell(event: Event, store_or_sell: str = ArgPlainText()):
     qq = event.get_user_id()
-    user = users.get(qq)
+    user = await get_user_async(qq)
     from nonebot.matcher import current_matcher
     matcher = current_matcher.get()
     new_eq = matcher.state.get("new_equipment")
@@ -400,16 +532,65 @@ async def _handle_equipment_store_or_sell(event: Event, store_or_sell: str = Arg
     store_or_sell = store_or_sell.strip()
     
     if store_or_sell == "2":
-        # 选择出售：从仓库移除装备并给予哈哈币
-        if new_eq in user.equipment_storage:
-            user.equipment_storage.remove(new_eq)
-            save_user_equipment_storage(qq, user.equipment_storage)
-        user.gold += new_eq.value
-        save_user(user)
+        # 选择出售：从仓库移除装备并给予哈哈币（装备可能已在配装中被出售或换上）
+        with user_locks.hold(qq):
+            idx = _storage_index(user, new_eq)
+            if idx >= 0:
+                user.equipment_storage.pop(idx)
+                user.gold += new_eq.value
+                mark_dirty(user)
+        if idx < 0:
+            await equip_start_cmd.finish(msg+"该装备已不在仓库中！")
         await equip_start_cmd.finish(msg+f"已出售{new_eq.name}，获得{new_eq.value}哈哈币。\n当前哈哈币：{user.gold}")
     else:
         # 选择1或其他输入：装备已在仓库，只需提示
-        await equip_start_cmd.finish(msg+f"已存入装备仓库（当前{len(user.equipment_storage)}/10）！")
+        await equip_start_cmd.finish(msg+f"已存入装备仓库（当前{len(user.equipment_storage)}/{equipment_storage_capacity}）！")
+
+
+# 十连抽：先选择存入/出售规则，再一次性抽取、扣费、存入和出售
+multi_draw_keep_options = {
+    "1": (0, "全部存入仓库"),
+    "2": (1, "只保留稀有及以上"),
+    "3": (2, "只保留史诗及以上"),
+    "4": (None, "全部出售"),
+}
+multi_draw_cmd = on_command("十连抽", rule=is_exact_command("十连抽"), priority=10)
+@multi_draw_cmd.handle()
+async def _multi_draw_start(event: Event):
+    qq = event.get_user_id()
+    await check_retreat_status_async(qq)
+    user = await get_or_init_user_async(qq)
+    if user.status != 0:
+        await multi_draw_cmd.finish(MessageSegment.at(qq) + "\n你不在空闲状态，不能起装！")
+    options = "\n".join(f"{key}. {label}" for key, (_, label) in multi_draw_keep_options.items())
+    prompt = (
+        MessageSegment.at(qq) + "\n"
+        + f"{equipment_multi_draw_count}连抽共需{equipment_draw_cost * equipment_multi_draw_count}哈哈币，"
+        + f"仓库放不下的装备会自动出售（当前仓库{len(user.equipment_storage)}/{equipment_storage_capacity}）。请选择：\n"
+        + "0. 我后悔了，不抽了\n"
+        + options
+    )
+    await multi_draw_cmd.send(prompt)
+
+
+@multi_draw_cmd.got("keep_mode")
+async def _multi_draw_keep_mode(event: Event, keep_mode: str = ArgPlainText()):
+    qq = event.get_user_id()
+    keep_mode = keep_mode.strip()
+    msg = MessageSegment.at(qq) + "\n"
+    if keep_mode == "0":
+        await multi_draw_cmd.finish(msg + "已取消抽奖。")
+    if keep_mode not in multi_draw_keep_options:
+        await multi_draw_cmd.reject(msg + f"请输入0到{len(multi_draw_keep_options)}！")
+    keep_quality, _ = multi_draw_keep_options[keep_mode]
+    success, summary, results = await draw_equipment_batch_for_purchase_async(qq, equipment_multi_draw_count, keep_quality)
+    if not success:
+        await multi_draw_cmd.finish(msg + summary)
+    lines = [
+        f"[{idx}] {quality_map.get(getattr(eq, 'quality', 0), '未知')} {eq.name} {eq.value}哈哈币 → {'存入' if stored else '出售'}"
+        for idx, (eq, stored) in enumerate(results, 1)
+    ]
+    await multi_draw_cmd.finish(msg + "\n".join(lines) + "\n" + summary)
 
 # 配装命令
 peizhuang_cmd = on_command("配装", rule=is_exact_command("配装"), priority=10)
@@ -417,28 +598,26 @@ peizhuang_cmd = on_command("配装", rule=is_exact_command("配装"), priority=1
 @peizhuang_cmd.handle()
 async def _peizhuang_handler(bot: Bot, event: Event):
     qq = event.get_user_id()
-    check_retreat_status(qq)
-    user = users.get(qq)
+    await check_retreat_status_async(qq)
+    user = await get_or_init_user_async(qq)
     msg = MessageSegment.at(qq) + "\n"
-    if not user:
-        user = user_init(qq)
     if user.status != 0:
         await peizhuang_cmd.finish(msg + "你只能在空闲状态下配装！")
     if not user.equipment_storage:
         msg += "装备仓库为空，可通过抽奖获得装备。"
         await peizhuang_cmd.finish(msg)
-    msg += "装备仓库列表：\n"
-    for idx, eq in enumerate(user.equipment_storage, 1):
-        quality = quality_map.get(getattr(eq, 'quality', 0), "未知")
-        eq_type = equipment_type_map.get(getattr(eq, 'equipment_type', 99), "未知")
-        msg += f"[{idx}] {quality} {eq_type} {eq.name}\n"
-    msg += "\n请输入序号选择装备，回复0退出。"
+    # 先拼好所有行再一次性加入消息，避免逐行拼接 Message
+    lines = [
+        f"[{idx}] {quality_map.get(getattr(eq, 'quality', 0), '未知')} {equipment_type_map.get(getattr(eq, 'equipment_type', 99), '未知')} {eq.name}"
+        for idx, eq in enumerate(user.equipment_storage, 1)
+    ]
+    msg += "装备仓库列表：\n" + "\n".join(lines) + "\n\n请输入序号选择装备，回复0退出。"
     await peizhuang_cmd.send(msg)
 
 @peizhuang_cmd.got("select_idx")
 async def _peizhuang_select(event: Event, select_idx: str = ArgPlainText()):
     qq = event.get_user_id()
-    user = users.get(qq)
+    user = await get_user_async(qq)
     msg = MessageSegment.at(qq) + "\n"
     if not user or not user.equipment_storage:
         await peizhuang_cmd.finish(msg + "装备仓库为空。")
@@ -457,58 +636,61 @@ async def _peizhuang_select(event: Event, select_idx: str = ArgPlainText()):
     msg += f"请选择要进行的操作：\n1. 装备当前装备\n2. 出售装备，获得{eq.value}哈哈币"
     from nonebot.matcher import current_matcher
     matcher = current_matcher.get()
-    matcher.state["selected_eq_idx"] = idx-1
+    matcher.state["selected_eq"] = eq
     await peizhuang_cmd.send(msg)
 
 @peizhuang_cmd.got("action")
 async def _peizhuang_action(event: Event, action: str = ArgPlainText()):
     qq = event.get_user_id()
-    user = users.get(qq)
+    user = await get_user_async(qq)
     msg = MessageSegment.at(qq) + "\n"
     from nonebot.matcher import current_matcher
     matcher = current_matcher.get()
-    idx = matcher.state.get("selected_eq_idx")
-    eq = user.equipment_storage[idx]
-    if action == "2":
-        # 出售
-        user.gold += eq.value
-        user.equipment_storage.pop(idx)
-        save_user(user)
-        save_user_equipment_storage(qq, user.equipment_storage)
-        await peizhuang_cmd.finish(msg + f"已出售{eq.name}，获得{eq.value}哈哈币。\n当前哈哈币：{user.gold}")
-    elif action == "1":
-        # 装备
-        if len(user.equipment) < 4:
-            # 检查是否已经装备了相同ID的装备
-            if any(e.id == eq.id for e in user.equipment):
-                await peizhuang_cmd.finish(msg + "不能重复装备相同物品，请尝试出售重复装备！")
-            user.equipment.append(eq)
+    eq = matcher.state.get("selected_eq")
+    if action not in ("1", "2"):
+        await peizhuang_cmd.reject(msg + "请输入1装备或2出售！")
+    with user_locks.hold(qq):
+        # 选择装备后仓库可能已被其他指令改动，按对象重新定位
+        idx = _storage_index(user, eq)
+        if idx < 0:
+            result = "该装备已不在仓库中，已退出配装！"
+        elif action == "2":
+            # 出售
+            user.gold += eq.value
             user.equipment_storage.pop(idx)
-            save_user(user)
-            save_user_equipment(qq, user.equipment)
-            save_user_equipment_storage(qq, user.equipment_storage)
-            await peizhuang_cmd.finish(msg + f"已装备{eq.name}！\n当前装备数：{len(user.equipment)}/4")
-        else:
+            mark_dirty(user)
+            result = f"已出售{eq.name}，获得{eq.value}哈哈币。\n当前哈哈币：{user.gold}"
+        elif len(user.equipment) >= 4:
             # 已装备4件，需替换
-            msg += "你已装备4件装备，需要替换现有装备：\n"
-            for i, old_eq in enumerate(user.equipment, 1):
-                quality = quality_map.get(getattr(old_eq, 'quality', 0), "未知")
-                eq_type = equipment_type_map.get(getattr(old_eq, 'equipment_type', 99), "未知")
-                msg += f"[{i}] {quality} {eq_type} {old_eq.name}\n"
-            msg += f"\n请选择要进行的操作：\n1-4. 选择对应装备进行替换\n5. 出售装备，获得{eq.value}哈哈币\n6. 取消替换，装备放回仓库"
-            matcher.state["to_equip_idx"] = idx
-            await peizhuang_cmd.send(msg)
-    else:
-        await peizhuang_cmd.reject(msg + "请输入1装备或2出售！")
+            result = None
+        elif any(e.id == eq.id for e in user.equipment):
+            # 检查是否已经装备了相同ID的装备
+            result = "不能重复装备相同物品，请尝试出售重复装备！"
+        else:
+            # 装备
+            user.equip_item(eq)
+            user.equipment_storage.pop(idx)
+            mark_dirty(user)
+            result = f"已装备{eq.name}！\n当前装备数：{len(user.equipment)}/4"
+    if result is not None:
+        await peizhuang_cmd.finish(msg + result)
+
+    msg += "你已装备4件装备，需要替换现有装备：\n"
+    for i, old_eq in enumerate(user.equipment, 1):
+        quality = quality_map.get(getattr(old_eq, 'quality', 0), "未知")
+        eq_type = equipment_type_map.get(getattr(old_eq, 'equipment_type', 99), "未知")
+        msg += f"[{i}] {quality} {eq_type} {old_eq.name}\n"
+    msg += f"\n请选择要进行的操作：\n1-4. 选择对应装备进行替换\n5. 出售装备，获得{eq.value}哈哈币\n6. 取消替换，装备放回仓库"
+    await peizhuang_cmd.send(msg)
 
 @peizhuang_cmd.got("replace_idx")
 async def _peizhuang_replace(event: Event, replace_idx: str = ArgPlainText()):
     qq = event.get_user_id()
-    user = users.get(qq)
+    user = await get_user_async(qq)
     msg = MessageSegment.at(qq) + "\n"
     from nonebot.matcher import current_matcher
     matcher = current_matcher.get()
-    to_equip_idx = matcher.state.get("to_equip_idx")
+    new_eq = matcher.state.get("selected_eq")
     if not replace_idx.isdigit():
         await peizhuang_cmd.reject(msg + "请输入正确的序号！")
     rep_idx = int(replace_idx)
@@ -517,32 +699,34 @@ async def _peizhuang_replace(event: Event, replace_idx: str = ArgPlainText()):
     if rep_idx == 6:
         await peizhuang_cmd.finish(msg + "已取消替换，装备保留在仓库中。")
     
-    # 选项5：出售装备
-    if rep_idx == 5:
-        eq = user.equipment_storage[to_equip_idx]
-        user.gold += eq.value
-        user.equipment_storage.pop(to_equip_idx)
-        save_user(user)
-        save_user_equipment_storage(qq, user.equipment_storage)
-        await peizhuang_cmd.finish(msg + f"已出售{eq.name}，获得{eq.value}哈哈币。\n当前哈哈币：{user.gold}")
-    
     # 选项1-4：替换装备
-    if rep_idx < 1 or rep_idx > len(user.equipment):
+    if rep_idx != 5 and (rep_idx < 1 or rep_idx > len(user.equipment)):
         await peizhuang_cmd.reject(msg + "序号超出范围，请重新输入！")
     
-    # 检查是否装备了相同的装备
-    new_eq = user.equipment_storage[to_equip_idx]
-    if any(e.id == new_eq.id for e in user.equipment):
-        await peizhuang_cmd.finish(msg + "不能重复装备相同物品，请尝试出售重复装备！")
-    
-    # 交换装备
-    old_eq = user.equipment[rep_idx-1]
-    user.equipment_storage[to_equip_idx] = old_eq
-    user.equipment[rep_idx-1] = new_eq
-    save_user(user)
-    save_user_equipment(qq, user.equipment)
-    save_user_equipment_storage(qq, user.equipment_storage)
-    await peizhuang_cmd.finish(msg + f"已用{new_eq.name}（{equipment_type_map.get(getattr(new_eq, 'equipment_type', 99), '未知')}）替换{old_eq.name}（{equipment_type_map.get(getattr(old_eq, 'equipment_type', 99), '未知')}）！")
+    with user_locks.hold(qq):
+        idx = _storage_index(user, new_eq)
+        if idx < 0:
+            result = "该装备已不在仓库中，已退出配装！"
+        elif rep_idx == 5:
+            # 选项5：出售装备
+            user.gold += new_eq.value
+            user.equipment_storage.pop(idx)
+            mark_dirty(user)
+            result = f"已出售{new_eq.name}，获得{new_eq.value}哈哈币。\n当前哈哈币：{user.gold}"
+        elif rep_idx > len(user.equipment):
+            result = "序号超出范围，已退出配装！"
+        elif any(e.id == new_eq.id for e in user.equipment):
+            # 检查是否装备了相同的装备
+            result = "不能重复装备相同物品，请尝试出售重复装备！"
+        else:
+            # 交换装备
+            old_eq = user.equipment[rep_idx-1]
+            user.equipment_storage[idx] = old_eq
+            user.equipment[rep_idx-1] = new_eq
+            user.invalidate_stats()
+            mark_dirty(user)
+            result = f"已用{new_eq.name}（{equipment_type_map.get(getattr(new_eq, 'equipment_type', 99), '未知')}）替换{old_eq.name}（{equipment_type_map.get(getattr(old_eq, 'equipment_type', 99), '未知')}）！"
+    await peizhuang_cmd.finish(msg + result)
 
 
 # 更新补偿指令：每人限领一次，再触发扣1000
@@ -550,18 +734,19 @@ compensation_cmd = on_command("更新补偿。。。", rule=is_exact_command("
 @compensation_cmd.handle()
 async def _compensation_handler(bot: Bot, event: Event):
     qq = event.get_user_id()
-    user = users.get(qq)
-    if not user:
-        user = user_init(qq)
+    user = await get_or_init_user_async(qq)
     msg = MessageSegment.at(qq) + "\n"
-    if qq not in claimed_compensation:
-        claimed_compensation.add(qq)
-        user.gold += 20000
-        save_user(user)
+    with user_locks.hold(qq):
+        first_claim = qq not in claimed_compensation
+        if first_claim:
+            claimed_compensation.add(qq)
+            user.gold += 20000
+        else:
+            user.gold -= 1000
+        mark_dirty(user)
+    if first_claim:
         await compensation_cmd.finish(msg + f"更新补偿已领取：+20000哈哈币\n当前哈哈币：{user.gold}")
     else:
-        user.gold -= 1000
-        save_user(user)
         await compensation_cmd.finish(msg + f"贪婪之罪，扣1000哈哈币\n当前哈哈币：{user.gold}")
 
 
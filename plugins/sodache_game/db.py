@@ -1,423 +1,397 @@
 import sqlite3
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from .models.game_models import User, Item, Equipment
 from .utils.connection_pool import ConnectionPool
+from .utils.equipment_codec import encode_overrides, decode_equipment
+from .item_data import item_by_key
+from .migrations import migrate
 
 db_path = "game_data.db"
 db_timeout = 5  # 数据库操作超时时间（秒）
-pool_size = 10  # 连接池大小
+pool_size = 10  # 连接池大小（最多同时打开的连接数）
+pool_wait_timeout = 10  # 连接池耗尽时等待连接归还的最长时间（秒）
+write_behind_interval = 3  # 脏用户写回间隔（秒）
+write_behind_threshold = 50  # 脏用户数量达到该值时立即写回
+storage_profile = "balanced"  # SQLite 性能配置档，见 STORAGE_PROFILES
 
-sqlite_pool = ConnectionPool(db_path, pool_size, db_timeout)
+# SQLite 性能配置档：每个新连接创建时执行对应的 PRAGMA
+STORAGE_PROFILES: Dict[str, Dict[str, object]] = {
+    # SQLite 默认行为：回滚日志，每次提交完整同步，最安全也最慢
+    "durable": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,        # 负数表示 KiB，即 2MB
+        "temp_store": "DEFAULT",
+    },
+    # WAL 日志，提交时不等待落盘；断电可能丢失最近的提交，但数据库不会损坏，读写互不阻塞
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+    },
+    # 完全不同步，进程崩溃都可能损坏数据库，仅用于测试和模拟
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+}
 
-def init_db():
-    """初始化数据库表"""
-    conn = sqlite_pool.get_conn()  # 从连接池获取连接
-    cursor = conn.cursor()
-    
-    # 创建用户表
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        qq TEXT PRIMARY KEY,
-        attack INTEGER DEFAULT 10,
-        defense INTEGER DEFAULT 5,
-        luck INTEGER DEFAULT 0,
-        speed INTEGER DEFAULT 0,
-        search_time INTEGER DEFAULT 0,
-        gold INTEGER DEFAULT 100,
-        status INTEGER DEFAULT 0,
-        search_start_time INTEGER DEFAULT 0,
-        attack_cooldown_start INTEGER DEFAULT 0,
-        retreat_start_time INTEGER DEFAULT 0,
-        search_group TEXT DEFAULT '',
-        user_bag_items_nums INTEGER DEFAULT 0,
-        have_searched_nums INTEGER DEFAULT 0,
-        attack_cooldown_end_time INTEGER DEFAULT 0,
-        backpack_capacity INTEGER DEFAULT 4,
-        attack_protection_end_time INTEGER DEFAULT 0
-    )
-    """)
-    # 检查user_items表是否存在旧结构
-    cursor.execute("PRAGMA table_info(user_items)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'id' not in columns:
-        # 旧表结构存在，需要迁移数据
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_items_temp (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_qq TEXT,
-            item_id TEXT,
-            item_name TEXT,
-            item_value INTEGER,
-            item_quality INTEGER
-        )
-        """)
-        
-        # 检查旧表是否存在
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_items'")
-        old_table_exists = cursor.fetchone() is not None
-        
-        if old_table_exists:
-            # 复制数据到新表
-            cursor.execute("""
-            INSERT INTO user_items_temp (user_qq, item_id, item_name, item_value, item_quality)
-            SELECT user_qq, item_id, item_name, item_value, item_quality FROM user_items
-            """)
-            # 删除旧表
-            cursor.execute("DROP TABLE user_items")
-        
-        # 重命名新表
-        cursor.execute("ALTER TABLE user_items_temp RENAME TO user_items")
-    else:
-        # 新表结构已经存在，只需要确保表存在
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_qq TEXT,
-            item_id TEXT,
-            item_name TEXT,
-            item_value INTEGER,
-            item_quality INTEGER
-        )
-        """)
-    
-    # 创建用户装备表
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_equipment (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_qq TEXT,
-        item_id TEXT,
-        item_name TEXT,
-        item_value INTEGER,
-        item_quality INTEGER,
-        equipment_type INTEGER DEFAULT 99,
-        add_to_attack INTEGER DEFAULT 0,
-        add_to_defense INTEGER DEFAULT 0,
-        increase_attack INTEGER DEFAULT 0,
-        increase_defense INTEGER DEFAULT 0,
-        equip_luck INTEGER DEFAULT 0,
-        extra_search_time INTEGER DEFAULT 0,
-        extra_retreat_time INTEGER DEFAULT 0,
-        equip_attack_cooldown INTEGER DEFAULT 0,
-        extra_backpack_capacity INTEGER DEFAULT 0,
-        extra_attack_protection_duration INTEGER DEFAULT 0
+def get_storage_pragmas(profile: str) -> Dict[str, object]:
+    """返回性能配置档对应的 PRAGMA"""
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"未知的存储配置档：{profile}，可选：{', '.join(STORAGE_PROFILES)}")
+    return STORAGE_PROFILES[profile]
+
+def apply_storage_profile(conn: sqlite3.Connection, profile: str) -> None:
+    """对不经过连接池创建的连接应用性能配置档"""
+    for name, value in get_storage_pragmas(profile).items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+sqlite_pool = ConnectionPool(db_path, pool_size, db_timeout, pool_wait_timeout, get_storage_pragmas(storage_profile))
+
+@contextmanager
+def _use_conn(conn: Optional[sqlite3.Connection]) -> Iterator[sqlite3.Connection]:
+    """传入连接时直接使用，由调用方负责提交；否则从连接池借出，结束时提交并归还"""
+    if conn is not None:
+        yield conn
+        return
+    with sqlite_pool.connection() as pooled:
+        yield pooled
+
+def init_db(conn: Optional[sqlite3.Connection] = None):
+    """初始化数据库表：执行尚未执行的结构迁移，已是最新版本时只读取一次版本号"""
+    with _use_conn(conn) as conn:
+        migrate(conn)
+
+# 查询字段，顺序与下方 _*_from_row 的下标一致
+USER_FIELDS = """qq, attack, defense, luck, speed, search_time, gold, status, search_start_time,
+    attack_cooldown_start, retreat_start_time, search_group, user_bag_items_nums, have_searched_nums,
+    attack_cooldown_end_time, backpack_capacity, attack_protection_end_time, retreat_report_value, retreat_report_time"""
+ITEM_FIELDS = "item_id, item_name, item_value, item_quality, id"
+EQUIPMENT_FIELDS = "item_id, overrides, id"
+
+def _user_from_row(row) -> User:
+    return User(
+        qq=row[0],
+        attack=row[1],
+        defense=row[2],
+        luck=row[3],
+        speed=row[4],
+        search_time=row[5],
+        gold=row[6],
+        status=row[7],
+        search_start_time=row[8],
+        attack_cooldown_start=row[9],
+        retreat_start_time=row[10],
+        search_group=row[11],
+        user_bag_items_nums=row[12],
+        have_searched_nums=row[13],
+        attack_cooldown_end_time=row[14],
+        backpack_capacity=row[15],
+        attack_protection_end_time=row[16],
+        retreat_report_value=row[17],
+        retreat_report_time=row[18]
     )
-    """)
-    
-    # 创建装备仓库表
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_equipment_storage (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_qq TEXT,
-        item_id TEXT,
-        item_name TEXT,
-        item_value INTEGER,
-        item_quality INTEGER,
-        equipment_type INTEGER DEFAULT 99,
-        add_to_attack INTEGER DEFAULT 0,
-        add_to_defense INTEGER DEFAULT 0,
-        increase_attack INTEGER DEFAULT 0,
-        increase_defense INTEGER DEFAULT 0,
-        equip_luck INTEGER DEFAULT 0,
-        extra_search_time INTEGER DEFAULT 0,
-        extra_retreat_time INTEGER DEFAULT 0,
-        equip_attack_cooldown INTEGER DEFAULT 0,
-        extra_backpack_capacity INTEGER DEFAULT 0,
-        extra_attack_protection_duration INTEGER DEFAULT 0
+
+def _item_from_row(row) -> Item:
+    # 与物品模板一致时直接复用模板对象，只有数据已和模板不同的旧物品才新建
+    template = item_by_key.get((row[0], row[1]))
+    if template is not None and template.value == row[2] and template.quality == row[3]:
+        return template
+    return Item(id=row[0], name=row[1], value=row[2], quality=row[3])
+
+def _equipment_from_row(row) -> Equipment:
+    # 装备行只保存装备id和相对模板的差异，其余属性从 equipment_data 中的模板还原
+    return decode_equipment(row[0], row[1])
+
+USER_UPSERT = """
+INSERT OR REPLACE INTO users (
+    qq, attack, defense, luck, speed, search_time, gold, status, search_start_time,
+    attack_cooldown_start, retreat_start_time, search_group, user_bag_items_nums, have_searched_nums, attack_cooldown_end_time, backpack_capacity, attack_protection_end_time,
+    retreat_report_value, retreat_report_time
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _user_params(user: User) -> tuple:
+    return (
+        user.qq, user.attack, user.defense, user.luck, user.speed, user.search_time, user.gold, user.status,
+        user.search_start_time, user.attack_cooldown_start, user.retreat_start_time, user.search_group,
+        user.user_bag_items_nums, user.have_searched_nums, user.attack_cooldown_end_time, user.backpack_capacity, user.attack_protection_end_time,
+        user.retreat_report_value, user.retreat_report_time
     )
-    """)
-    
-    # 为user_qq字段创建索引，提高查询效率
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_equipment_qq ON user_equipment(user_qq)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_equipment_storage_qq ON user_equipment_storage(user_qq)")
-    
-    conn.commit()
-    sqlite_pool.put_conn(conn)  # 将连接放回连接池
 
 def save_user(user: User, conn: Optional[sqlite3.Connection] = None):
     """保存用户数据到数据库"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT OR REPLACE INTO users (
-        qq, attack, defense, luck, speed, search_time, gold, status, search_start_time,
-        attack_cooldown_start, retreat_start_time, search_group, user_bag_items_nums, have_searched_nums, attack_cooldown_end_time, backpack_capacity, attack_protection_end_time
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        user.qq, user.attack, user.defense, user.luck, user.speed, user.search_time, user.gold, user.status,
-        user.search_start_time, user.attack_cooldown_start, user.retreat_start_time, user.search_group,
-        user.user_bag_items_nums, user.have_searched_nums, user.attack_cooldown_end_time, user.backpack_capacity, user.attack_protection_end_time
-    ))
-    
-    if use_pool:
-        conn.commit()
-        sqlite_pool.put_conn(conn)
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(USER_UPSERT, _user_params(user))
 
 def load_user(qq: str, conn: Optional[sqlite3.Connection] = None) -> User:
     """从数据库加载用户数据"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE qq = ?", (qq,))
-    row = cursor.fetchone()
-    
-    if use_pool:
-        sqlite_pool.put_conn(conn)
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {USER_FIELDS} FROM users WHERE qq = ?", (qq,))
+        row = cursor.fetchone()
     
     if row:
-        return User(
-            qq=row[0],
-            attack=row[1],
-            defense=row[2],
-            luck=row[3],
-            speed=row[4],
-            search_time=row[5],
-            gold=row[6],
-            status=row[7],
-            search_start_time=row[8],
-            attack_cooldown_start=row[9],
-            retreat_start_time=row[10],
-            search_group=row[11],
-            user_bag_items_nums=row[12],
-            have_searched_nums=row[13],
-            attack_cooldown_end_time=row[14],
-            backpack_capacity=row[15],
-            attack_protection_end_time=row[16]
-        )
+        return _user_from_row(row)
     return None
 
-def save_user_items(user_qq: str, items: List[Item], conn: Optional[sqlite3.Connection] = None):
-    """保存用户物品到数据库"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    
-    # 先删除旧的物品记录
-    cursor.execute("DELETE FROM user_items WHERE user_qq = ?", (user_qq,))
-    
-    # 插入新的物品记录
-    for item in items:
-        cursor.execute("""
-        INSERT INTO user_items (user_qq, item_id, item_name, item_value, item_quality)
-        VALUES (?, ?, ?, ?, ?)
-        """, (user_qq, item.id, item.name, item.value, item.quality))
-    
-    if use_pool:
-        conn.commit()
-        sqlite_pool.put_conn(conn)
-
-def save_user_equipment(user_qq: str, equipment: List[Equipment], conn: Optional[sqlite3.Connection] = None):
-    """保存用户装备到数据库"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    
-    # 先删除旧的装备记录
-    cursor.execute("DELETE FROM user_equipment WHERE user_qq = ?", (user_qq,))
-    
-    # 插入新的装备记录
-    for eq in equipment:
-        cursor.execute("""
-        INSERT INTO user_equipment (
-            user_qq, item_id, item_name, item_value, item_quality, equipment_type,
-            add_to_attack, add_to_defense, increase_attack, increase_defense,
-            equip_luck, extra_search_time, extra_retreat_time, equip_attack_cooldown,
-            extra_backpack_capacity, extra_attack_protection_duration
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user_qq, eq.id, eq.name, eq.value, eq.quality, getattr(eq, 'equipment_type', 99),
-            getattr(eq, 'add_to_attack', 0), getattr(eq, 'add_to_defense', 0),
-            getattr(eq, 'increase_attack', 0), getattr(eq, 'increase_defense', 0),
-            getattr(eq, 'equip_luck', 0), getattr(eq, 'extra_search_time', 0),
-            getattr(eq, 'extra_retreat_time', 0), getattr(eq, 'equip_attack_cooldown', 0),
-            getattr(eq, 'extra_backpack_capacity', 0), getattr(eq, 'extra_attack_protection_duration', 0)
-        ))
-    
-    if use_pool:
-        conn.commit()
-        sqlite_pool.put_conn(conn)
-
-def load_user_items(user_qq: str, conn: Optional[sqlite3.Connection] = None) -> List[Item]:
-    """从数据库加载用户物品"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    cursor.execute("SELECT item_id, item_name, item_value, item_quality FROM user_items WHERE user_qq = ?", (user_qq,))
-    rows = cursor.fetchall()
-    
-    if use_pool:
-        sqlite_pool.put_conn(conn)
+ITEM_COLUMNS = ("user_qq", "item_id", "item_name", "item_value", "item_quality")
+EQUIPMENT_COLUMNS = ("user_qq", "item_id", "overrides")
+
+# 行id映射：{id(对象): (对象, [行id])}，保留对象引用以防 id 被回收复用
+RowIds = Dict[int, Tuple[Any, List[int]]]
+
+def _item_params(user_qq: str, item: Item) -> tuple:
+    return (user_qq, item.id, item.name, item.value, item.quality)
+
+def _equipment_params(user_qq: str, eq: Equipment) -> tuple:
+    return (user_qq, eq.id, encode_overrides(eq))
+
+def _sync_rows(cursor: sqlite3.Cursor, table: str, columns: Tuple[str, ...], user_qq: str, objs: List[Any],
+               row_ids: Optional[RowIds], to_params) -> RowIds:
+    """
+    同步某个用户在指定表中的行，返回同步后的行id映射
+    - row_ids 为 None 时不清楚库中已有哪些行，删除该用户的所有行后全部重新插入
+    - 否则按对象比较，只删除已移除对象的行、插入新增对象的行
+    """
+    synced: RowIds = {}
+    if row_ids is None:
+        cursor.execute(f"DELETE FROM {table} WHERE user_qq = ?", (user_qq,))
+        to_insert = objs
+    else:
+        remaining = {key: list(ids) for key, (_, ids) in row_ids.items()}
+        to_insert = []
+        for obj in objs:
+            ids = remaining.get(id(obj))
+            if ids:
+                synced.setdefault(id(obj), (obj, []))[1].append(ids.pop())
+            else:
+                to_insert.append(obj)
+        deleted = [(row_id,) for ids in remaining.values() for row_id in ids]
+        if deleted:
+            cursor.executemany(f"DELETE FROM {table} WHERE id = ?", deleted)
+    
+    if to_insert:
+        placeholders = ", ".join("?" * len(columns))
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            [to_params(user_qq, obj) for obj in to_insert]
+        )
+        # AUTOINCREMENT 保证新插入的行id最大且按插入顺序递增
+        cursor.execute(f"SELECT id FROM {table} WHERE user_qq = ? ORDER BY id DESC LIMIT ?", (user_qq, len(to_insert)))
+        new_ids = [row[0] for row in cursor.fetchall()]
+        new_ids.reverse()
+        for obj, row_id in zip(to_insert, new_ids):
+            synced.setdefault(id(obj), (obj, []))[1].append(row_id)
+    return synced
+
+def _track_row(row_ids: Optional[RowIds], obj: Any, row_id: int) -> None:
+    if row_ids is not None:
+        row_ids.setdefault(id(obj), (obj, []))[1].append(row_id)
+
+def save_user_items(user_qq: str, items: List[Item], conn: Optional[sqlite3.Connection] = None,
+                    row_ids: Optional[RowIds] = None) -> RowIds:
+    """保存用户物品到数据库，传入 row_ids 时只写入变化的行，返回新的行id映射"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        synced = _sync_rows(cursor, "user_items", ITEM_COLUMNS, user_qq, items, row_ids, _item_params)
+    return synced
+
+def save_user_equipment(user_qq: str, equipment: List[Equipment], conn: Optional[sqlite3.Connection] = None,
+                        row_ids: Optional[RowIds] = None) -> RowIds:
+    """保存用户装备到数据库，传入 row_ids 时只写入变化的行，返回新的行id映射"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        synced = _sync_rows(cursor, "user_equipment", EQUIPMENT_COLUMNS, user_qq, equipment, row_ids, _equipment_params)
+    return synced
+
+def load_user_items(user_qq: str, conn: Optional[sqlite3.Connection] = None,
+                    row_ids: Optional[RowIds] = None) -> List[Item]:
+    """从数据库加载用户物品，传入 row_ids 时记录每件物品对应的行id"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {ITEM_FIELDS} FROM user_items WHERE user_qq = ?", (user_qq,))
+        rows = cursor.fetchall()
     
     items = []
     for row in rows:
-        items.append(Item(id=row[0], name=row[1], value=row[2], quality=row[3]))
+        item = _item_from_row(row)
+        _track_row(row_ids, item, row[4])
+        items.append(item)
     
     return items
 
-def save_user_equipment_storage(user_qq: str, equipment_storage: List[Equipment], conn: Optional[sqlite3.Connection] = None):
-    """保存用户装备仓库到数据库"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    
-    # 先删除旧的装备仓库记录
-    cursor.execute("DELETE FROM user_equipment_storage WHERE user_qq = ?", (user_qq,))
-    
-    # 插入新的装备仓库记录
-    for eq in equipment_storage:
-        cursor.execute("""
-        INSERT INTO user_equipment_storage (
-            user_qq, item_id, item_name, item_value, item_quality, equipment_type,
-            add_to_attack, add_to_defense, increase_attack, increase_defense,
-            equip_luck, extra_search_time, extra_retreat_time, equip_attack_cooldown,
-            extra_backpack_capacity, extra_attack_protection_duration
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user_qq, eq.id, eq.name, eq.value, eq.quality, getattr(eq, 'equipment_type', 99),
-            getattr(eq, 'add_to_attack', 0), getattr(eq, 'add_to_defense', 0),
-            getattr(eq, 'increase_attack', 0), getattr(eq, 'increase_defense', 0),
-            getattr(eq, 'equip_luck', 0), getattr(eq, 'extra_search_time', 0),
-            getattr(eq, 'extra_retreat_time', 0), getattr(eq, 'equip_attack_cooldown', 0),
-            getattr(eq, 'extra_backpack_capacity', 0), getattr(eq, 'extra_attack_protection_duration', 0)
-        ))
-    
-    if use_pool:
-        conn.commit()
-        sqlite_pool.put_conn(conn)
-
-def load_user_equipment(user_qq: str, conn: Optional[sqlite3.Connection] = None) -> List[Equipment]:
-    """从数据库加载用户装备"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT item_id, item_name, item_value, item_quality, equipment_type,
-           add_to_attack, add_to_defense, increase_attack, increase_defense,
-           equip_luck, extra_search_time, extra_retreat_time, equip_attack_cooldown,
-           extra_backpack_capacity, extra_attack_protection_duration
-    FROM user_equipment WHERE user_qq = ?
-    """, (user_qq,))
-    rows = cursor.fetchall()
-    
-    if use_pool:
-        sqlite_pool.put_conn(conn)
+def save_user_equipment_storage(user_qq: str, equipment_storage: List[Equipment], conn: Optional[sqlite3.Connection] = None,
+                                 row_ids: Optional[RowIds] = None) -> RowIds:
+    """保存用户装备仓库到数据库，传入 row_ids 时只写入变化的行，返回新的行id映射"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        synced = _sync_rows(cursor, "user_equipment_storage", EQUIPMENT_COLUMNS, user_qq, equipment_storage, row_ids, _equipment_params)
+    return synced
+
+def load_user_equipment(user_qq: str, conn: Optional[sqlite3.Connection] = None,
+                        row_ids: Optional[RowIds] = None) -> List[Equipment]:
+    """从数据库加载用户装备，传入 row_ids 时记录每件装备对应的行id"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {EQUIPMENT_FIELDS} FROM user_equipment WHERE user_qq = ?", (user_qq,))
+        rows = cursor.fetchall()
     
     equipment = []
     for row in rows:
-        equipment.append(Equipment(
-            id=row[0],
-            name=row[1],
-            value=row[2],
-            quality=row[3],
-            equipment_type=row[4],
-            add_to_attack=row[5],
-            add_to_defense=row[6],
-            increase_attack=row[7],
-            increase_defense=row[8],
-            equip_luck=row[9],
-            extra_search_time=row[10],
-            extra_retreat_time=row[11],
-            equip_attack_cooldown=row[12],
-            extra_backpack_capacity=row[13],
-            extra_attack_protection_duration=row[14]
-        ))
+        eq = _equipment_from_row(row)
+        _track_row(row_ids, eq, row[2])
+        equipment.append(eq)
     
     return equipment
 
-def load_user_equipment_storage(user_qq: str, conn: Optional[sqlite3.Connection] = None) -> List[Equipment]:
-    """从数据库加载用户装备仓库"""
-    use_pool = conn is None
-    if use_pool:
-        conn = sqlite_pool.get_conn()
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT item_id, item_name, item_value, item_quality, equipment_type,
-           add_to_attack, add_to_defense, increase_attack, increase_defense,
-           equip_luck, extra_search_time, extra_retreat_time, equip_attack_cooldown,
-           extra_backpack_capacity, extra_attack_protection_duration
-    FROM user_equipment_storage WHERE user_qq = ?
-    """, (user_qq,))
-    rows = cursor.fetchall()
-    
-    if use_pool:
-        sqlite_pool.put_conn(conn)
+def load_user_equipment_storage(user_qq: str, conn: Optional[sqlite3.Connection] = None,
+                                row_ids: Optional[RowIds] = None) -> List[Equipment]:
+    """从数据库加载用户装备仓库，传入 row_ids 时记录每件装备对应的行id"""
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {EQUIPMENT_FIELDS} FROM user_equipment_storage WHERE user_qq = ?", (user_qq,))
+        rows = cursor.fetchall()
     
     equipment_storage = []
     for row in rows:
-        equipment_storage.append(Equipment(
-            id=row[0],
-            name=row[1],
-            value=row[2],
-            quality=row[3],
-            equipment_type=row[4],
-            add_to_attack=row[5],
-            add_to_defense=row[6],
-            increase_attack=row[7],
-            increase_defense=row[8],
-            equip_luck=row[9],
-            extra_search_time=row[10],
-            extra_retreat_time=row[11],
-            equip_attack_cooldown=row[12],
-            extra_backpack_capacity=row[13],
-            extra_attack_protection_duration=row[14]
-        ))
+        eq = _equipment_from_row(row)
+        _track_row(row_ids, eq, row[2])
+        equipment_storage.append(eq)
     
     return equipment_storage
 
-def save_all(users_dict: Dict[str, User]):
-    """保存所有用户、物品和装备数据到数据库"""
-    conn = sqlite3.connect(db_path, timeout=db_timeout)
-    try:
-        for qq, user in users_dict.items():
-            save_user(user, conn=conn)
-            save_user_items(qq, user.inventory, conn=conn)
-            save_user_equipment(qq, user.equipment, conn=conn)
-            save_user_equipment_storage(qq, user.equipment_storage, conn=conn)
-        conn.commit()
-    finally:
-        conn.close()
-
-def load_all() -> Dict[str, User]:
-    """从数据库加载所有用户、物品和装备数据"""
-    users_dict = {}
-    
-    conn = sqlite3.connect(db_path, timeout=db_timeout)
-    
-    # 加载所有用户
-    cursor = conn.cursor()
-    cursor.execute("SELECT qq FROM users")
-    user_qqs = [row[0] for row in cursor.fetchall()]
-    cursor.close()  # 关闭查询用户列表的游标
-    
-    for qq in user_qqs:
+class UserSnapshot(NamedTuple):
+    """某一时刻用户数据的副本：users 表的一行和物品、装备、装备仓库列表（物品和装备不可变，复制列表即可）"""
+    user: User
+    row: tuple
+    inventory: List[Item]
+    equipment: List[Equipment]
+    equipment_storage: List[Equipment]
+
+def snapshot_user(user: User) -> UserSnapshot:
+    """复制用户当前的数据；调用方需持有该用户的锁，才能保证不会复制到修改了一半的数据"""
+    return UserSnapshot(user, _user_params(user), list(user.inventory), list(user.equipment), list(user.equipment_storage))
+
+def save_users(users_list: Iterable[User], conn: Optional[sqlite3.Connection] = None):
+    """
+    在一个事务内保存多个用户的用户数据、物品和装备（直接读取用户对象，不加锁）。
+    游戏运行时由写回队列调用 save_snapshots 写入，本函数供基准测试和离线脚本使用
+    """
+    save_snapshots([snapshot_user(user) for user in users_list], conn=conn)
+
+def save_snapshots(snapshots: Iterable[UserSnapshot], conn: Optional[sqlite3.Connection] = None):
+    """在一个事务内保存多个用户快照，物品和装备只写入变化的行"""
+    # 提交成功后才更新各用户的行id映射，回滚时保持原样
+    synced_rows = []
+    with _use_conn(conn) as conn:
+        try:
+            for snapshot in snapshots:
+                user = snapshot.user
+                conn.execute(USER_UPSERT, snapshot.row)
+                rows = user.persisted_rows
+                synced_rows.append((user, {
+                    "user_items": save_user_items(user.qq, snapshot.inventory, conn=conn, row_ids=rows.get("user_items")),
+                    "user_equipment": save_user_equipment(user.qq, snapshot.equipment, conn=conn, row_ids=rows.get("user_equipment")),
+                    "user_equipment_storage": save_user_equipment_storage(
+                        user.qq, snapshot.equipment_storage, conn=conn, row_ids=rows.get("user_equipment_storage")
+                    ),
+                }))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    for user, rows in synced_rows:
+        user.persisted_rows.update(rows)
+
+def load_active_sessions(conn: Optional[sqlite3.Connection] = None) -> List[Tuple[str, int, str]]:
+    """查询所有正在搜索或撤离的用户 (qq, 状态, 搜索所在群)，走 users(status) 部分索引"""
+    with _use_conn(conn) as conn:
+        return conn.execute("SELECT qq, status, search_group FROM users WHERE status != 0").fetchall()
+
+def load_user_columns(fields: Iterable[str], conn: Optional[sqlite3.Connection] = None) -> List[tuple]:
+    """查询所有用户的 (qq, *fields)，只读 users 表的指定列，用于初始化列存储"""
+    with _use_conn(conn) as conn:
+        return conn.execute(f"SELECT qq, {', '.join(fields)} FROM users").fetchall()
+
+def load_gold_ranking(conn: Optional[sqlite3.Connection] = None) -> List[Tuple[str, int, str]]:
+    """查询所有用户的 (qq, 哈哈币, 搜索所在群)，按哈哈币降序、QQ号升序排列，用于批量构建排行榜"""
+    with _use_conn(conn) as conn:
+        return conn.execute("SELECT qq, gold, search_group FROM users ORDER BY gold DESC, qq").fetchall()
+
+def load_user_full(qq: str, conn: Optional[sqlite3.Connection] = None) -> Optional[User]:
+    """从数据库加载单个用户及其物品、装备和装备仓库，用户不存在时返回 None"""
+    with _use_conn(conn) as conn:
         user = load_user(qq, conn=conn)
-        if user:
-            # 加载用户物品到inventory
-            user.inventory = load_user_items(qq, conn=conn)
-            # 加载用户装备到equipment
-            equipment_list = load_user_equipment(qq, conn=conn)
-            # 应用装备加成
-            for eq in equipment_list:
-                user.equip_item(eq)
-            # 加载装备仓库到equipment_storage
-            user.equipment_storage = load_user_equipment_storage(qq, conn=conn)
-            users_dict[qq] = user
+        if not user:
+            return None
+        rows = {"user_items": {}, "user_equipment": {}, "user_equipment_storage": {}}
+        user.inventory = load_user_items(qq, conn=conn, row_ids=rows["user_items"])
+        for eq in load_user_equipment(qq, conn=conn, row_ids=rows["user_equipment"]):
+            user.equip_item(eq)
+        user.equipment_storage = load_user_equipment_storage(qq, conn=conn, row_ids=rows["user_equipment_storage"])
+    user.persisted_rows.update(rows)
+    return user
+
+def _scan_rows(cursor: sqlite3.Cursor, table: str, fields: str, users_dict: Dict[str, User]):
+    """
+    按行id顺序扫描整张表（顺序读，不走 user_qq 索引回表），边读边按 user_qq 分组，
+    产出 (用户, 行)；行的最后一列为 user_qq，前面的下标与 _*_from_row 一致
+    """
+    cursor.execute(f"SELECT {fields}, user_qq FROM {table}")
+    last_qq = None
+    user = None
+    for row in cursor:
+        qq = row[-1]
+        if qq != last_qq:
+            last_qq = qq
+            user = users_dict.get(qq)
+        if user is not None:
+            yield user, row
+
+def load_all(conn: Optional[sqlite3.Connection] = None) -> Dict[str, User]:
+    """
+    从数据库加载所有用户、物品和装备数据，每张表只做一次顺序扫描。
+    游戏运行时按需通过 load_user_full 加载用户，不再调用本函数；目前只有 benchmarks/bench_load_all.py 使用
+    """
+    users_dict = {}
     
-    conn.close()
+    with _use_conn(conn) as conn:
+        cursor = conn.cursor()
+        
+        # 加载所有用户
+        cursor.execute(f"SELECT {USER_FIELDS} FROM users")
+        for row in cursor:
+            user = _user_from_row(row)
+            user.persisted_rows.update({"user_items": {}, "user_equipment": {}, "user_equipment_storage": {}})
+            users_dict[user.qq] = user
+        
+        # 加载用户物品到inventory
+        for user, row in _scan_rows(cursor, "user_items", ITEM_FIELDS, users_dict):
+            item = _item_from_row(row)
+            _track_row(user.persisted_rows["user_items"], item, row[4])
+            user.inventory.append(item)
+        
+        # 加载用户装备到equipment，逐件应用装备（同 id 的装备只会装备一次）
+        for user, row in _scan_rows(cursor, "user_equipment", EQUIPMENT_FIELDS, users_dict):
+            eq = _equipment_from_row(row)
+            _track_row(user.persisted_rows["user_equipment"], eq, row[2])
+            user.equip_item(eq)
+        
+        # 加载装备仓库到equipment_storage
+        for user, row in _scan_rows(cursor, "user_equipment_storage", EQUIPMENT_FIELDS, users_dict):
+            eq = _equipment_from_row(row)
+            _track_row(user.persisted_rows["user_equipment_storage"], eq, row[2])
+            user.equipment_storage.append(eq)
+        cursor.close()
     return users_dict
@@ -269,3 +269,6 @@ def _get_equipment_by_quality() -> Dict[int, List[Equipment]]:
     return result
 
 equipment_by_quality: Dict[int, List[Equipment]] = _get_equipment_by_quality()
+
+# ==================== 按装备id索引的装备模板（数据库只保存装备id，加载时据此还原属性）====================
+equipment_by_id: Dict[str, Equipment] = {eq.id: eq for eq in all_equipment}
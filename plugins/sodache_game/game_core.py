@@ -1,24 +1,213 @@
-import time
+import asyncio
+import logging
+import math
 import random
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from .models.game_models import User, Item, PlayerStats
 from .item_data import items_by_quality
-from .db import init_db, load_all, save_all, save_user, save_user_items, save_user_equipment, save_user_equipment_storage
+from .db import init_db, load_active_sessions, load_gold_ranking, load_user_columns, load_user_full, save_snapshots, snapshot_user, UserSnapshot, write_behind_interval, write_behind_threshold
+from .utils.write_behind import WriteBehindQueue
+from .utils.user_cache import UserCache
+from .utils.session_index import SessionIndex
+from .utils.player_columns import PlayerColumns
+from .utils.leaderboard import GoldLeaderboard
+from .utils.target_index import TargetIndex
+from .utils.sampler import AliasSampler
+from .utils.scheduler import EventKey, EventScheduler
+from .utils.locks import UserLocks
+from .utils.clock import SystemClock
+from .async_db import async_db
 from .equipment_data import all_equipment
-from dataclasses import asdict
 from .models.game_models import Equipment
 
+user_cache_max_users = 10000  # 最多缓存的用户数
+user_cache_memory_budget = 64 * 1024 * 1024  # 用户缓存的估算内存上限（字节）
+user_cache_min_idle = 600  # 用户空闲多久（秒）后才允许被淘汰出缓存
+scheduler_max_sleep = 1.0  # 定时事件循环两次检查之间的最长间隔（秒）
+
+# 数值平衡参数（经济模拟器 economy_simulator.py 会覆盖这些值进行调参）
+search_base_interval = 360  # 基础搜索间隔（秒），每个间隔抽取一件物品
+retreat_base_time = 600     # 基础撤离时间（秒）
+equipment_draw_cost = 5000  # 起装抽奖的花费（哈哈币）
+equipment_storage_capacity = 10  # 装备仓库容量
+equipment_multi_draw_count = 10  # 十连抽的抽取次数
+
+logger = logging.getLogger(__name__)
+
+# 所有计时规则（搜索间隔、冷却、保护、撤离）都通过 clock 取时间；
+# 基准测试和模拟可以用 set_clock(ManualClock(...)) 换成手动推进的时钟
+clock = SystemClock()
+
+def set_clock(new_clock) -> None:
+    """替换游戏使用的时钟（SystemClock 或 ManualClock）"""
+    global clock
+    clock = new_clock
+
+def now() -> int:
+    """当前时间戳（整秒）"""
+    return int(clock.time())
+
+# 修改用户数据前先锁定该用户；同时修改两个用户（如攻击）时一次性按固定顺序锁定，避免死锁
+user_locks = UserLocks()
+
 # 初始化数据库
 init_db()
-# 从数据库加载所有用户和物品数据
-users = load_all()
+def _snapshot_user(user: User) -> UserSnapshot:
+    # 在用户锁内复制数据，写库时不会读到修改了一半的用户（例如撤离已加哈哈币但还没清空背包）
+    with user_locks.hold(user.qq):
+        return snapshot_user(user)
+
+# 用户修改先标记为脏数据，由后台线程合并后批量写入数据库
+persist_queue = WriteBehindQueue(save_snapshots, write_behind_interval, write_behind_threshold, _snapshot_user)
+persist_queue.start()
+
+def _can_evict(user: User) -> bool:
+    # 还有未写入的修改时暂不淘汰，等后台线程写入后再淘汰，保证重新加载时数据是最新的；
+    # 不在这里同步写库，以免在事件循环线程中持有缓存锁执行数据库写入
+    return not persist_queue.is_dirty(user.qq)
+
+# 用户首次访问时才从数据库加载，按 LRU 淘汰空闲用户
+users = UserCache(load_user_full, user_cache_max_users, user_cache_memory_budget,
+                  user_cache_min_idle, _can_evict)
+
+# 正在搜索或撤离的用户索引（按状态、按群），启动时通过 users(status) 部分索引从数据库载入
+sessions = SessionIndex()
+for _qq, _status, _group in load_active_sessions():
+    sessions.update(_qq, _status, _group)
+
+# 所有玩家（包括不在缓存中的）数值字段的列存储，供全服统计使用；启动时只读取 users 表的数值列
+player_columns = PlayerColumns()
+for _row in load_user_columns(player_columns.fields):
+    player_columns.set(_row[0], _row[1:])
+
+# 哈哈币排行榜（全服和各群），随 mark_dirty 增量更新；启动时由 SQL 排好序的数据以 O(n) 批量构建
+leaderboard = GoldLeaderboard()
+leaderboard.load(load_gold_ranking())
+
+# 各群中可攻击的玩家（搜索或撤离中且不在被攻击保护中），保护结束时间取自列存储
+targets = TargetIndex()
+for _qq in sessions.with_status(1) | sessions.with_status(2):
+    _status, _group = sessions.get(_qq)
+    targets.update(_qq, _status, _group, player_columns.get(_qq, "attack_protection_end_time") or 0, clock.time())
+
+# 定时事件类型：下一次物品掉落、撤离完成（被攻击保护的结束由目标索引 targets 按时间处理，不需要定时事件）
+EVENT_DROP = "drop"
+EVENT_RETREAT = "retreat"
+
+# 每个用户下一次需要处理的事件，由后台任务 run_scheduler 统一处理到期事件
+scheduler = EventScheduler()
+# 启动时还没有加载活跃用户，先安排立即触发，首次处理时会按实际时间重新安排
+for _qq in sessions.with_status(1):
+    scheduler.schedule(_qq, EVENT_DROP, 0)
+for _qq in sessions.with_status(2):
+    scheduler.schedule(_qq, EVENT_RETREAT, 0)
+
+def _set_status(user: User, status: int) -> None:
+    """修改用户状态并同步活跃会话索引"""
+    user.status = status
+    sessions.update(user.qq, status, user.search_group)
+
+def get_active_users(status: Optional[int] = None, group: Optional[str] = None) -> List[str]:
+    """
+    查询正在搜索或撤离的用户QQ号，不需要遍历所有用户
+    :param status: 只返回该状态的用户（1搜索中，2撤离中），None 表示都返回
+    :param group: 只返回在该群中搜索的用户，None 表示不限群
+    """
+    if group is not None:
+        return list(sessions.in_group(group, status))
+    if status is not None:
+        return list(sessions.with_status(status))
+    return list(sessions.with_status(1) | sessions.with_status(2))
+
+def mark_dirty(user: User) -> None:
+    """标记用户数据已修改，等待写回数据库，同步列存储、排行榜和目标索引，并按新状态重新安排定时事件"""
+    persist_queue.mark_dirty(user)
+    player_columns.update(user)
+    leaderboard.update(user.qq, user.gold, user.search_group)
+    targets.update(user.qq, user.status, user.search_group, user.attack_protection_end_time, clock.time())
+    schedule_user_events(user)
+
+def schedule_user_events(user: User) -> None:
+    """根据用户当前状态安排下一次物品掉落和撤离完成事件"""
+    if user.status == 1 and user.user_bag_items_nums < user.backpack_capacity:
+        # 抽取按整秒计算，向上取整保证触发时至少已满一个间隔
+        scheduler.schedule(user.qq, EVENT_DROP, math.ceil(user.search_start_time + get_search_interval(user)))
+    else:
+        scheduler.cancel(user.qq, EVENT_DROP)
+    if user.status == 2:
+        scheduler.schedule(user.qq, EVENT_RETREAT, user.retreat_start_time + get_actual_retreat_time(user))
+    else:
+        scheduler.cancel(user.qq, EVENT_RETREAT)
+
+# 撤离完成时的回调，参数为用户和本次带出的物品总价值
+retreat_listeners: List[Callable[[User, int], None]] = []
+
+def add_retreat_listener(listener: Callable[[User, int], None]) -> None:
+    """注册撤离完成回调（无论由定时任务还是玩家指令触发都会调用）"""
+    retreat_listeners.append(listener)
+
+def _notify_retreat(user: User, total_value: int) -> None:
+    for listener in retreat_listeners:
+        try:
+            listener(user, total_value)
+        except Exception:
+            # 通知失败不影响撤离结算
+            logger.exception("撤离完成回调执行失败")
+
+@user_locks.locked()
+def _handle_event(qq: str, kind: str) -> None:
+    user = users.peek(qq)
+    if user is None:
+        return
+    if kind == EVENT_DROP:
+        extract_items_by_time(qq)
+    elif kind == EVENT_RETREAT:
+        check_retreat_status(qq)
+    # 状态可能没有变化（如时间尚未到达），重新安排以免事件丢失
+    schedule_user_events(user)
+
+def process_due_events(at: Optional[float] = None) -> List[EventKey]:
+    """同步处理所有到期事件，返回处理过的 (QQ号, 事件类型)"""
+    events = scheduler.pop_due(clock.time() if at is None else at)
+    for qq, kind in events:
+        users.get(qq)
+        _handle_event(qq, kind)
+    return events
+
+async def run_due_events() -> List[EventKey]:
+    """process_due_events 的异步版本，不在缓存中的用户通过异步数据库加载"""
+    events = scheduler.pop_due(clock.time())
+    for qq, kind in events:
+        try:
+            await get_user_async(qq)
+            _handle_event(qq, kind)
+        except Exception:
+            # 单个用户出错不影响同一批的其他事件
+            logger.exception("处理定时事件失败：%s %s", qq, kind)
+    return events
+
+async def run_scheduler() -> None:
+    """后台任务：处理到期事件，然后休眠到下一个事件（最长 scheduler_max_sleep 秒）"""
+    while True:
+        await run_due_events()
+        next_due = scheduler.next_due()
+        delay = scheduler_max_sleep if next_due is None else next_due - clock.time()
+        await asyncio.sleep(min(scheduler_max_sleep, max(0.05, delay)))
+
+def flush_users() -> int:
+    """立即把所有待写入的用户数据写入数据库"""
+    return persist_queue.flush()
 
 def get_player_stats(user: User) -> PlayerStats:
     """
     计算玩家的综合属性，包括基础属性和装备加成。
+    结果缓存在 user.stats_cache 中，装备或基础属性变化时由 invalidate_stats 清除。
     :param user: 用户对象
     :return: 包含综合属性的 PlayerStats 实例
     """
+    if user.stats_cache is not None:
+        return user.stats_cache
+
     # 初始化基础属性
     base_attack = float(user.attack)
     base_defense = float(user.defense)
@@ -74,8 +263,10 @@ def get_player_stats(user: User) -> PlayerStats:
         extra_retreat_time=add_extra_retreat_time,
     )
 
+    user.stats_cache = stats
     return stats
 
+@user_locks.locked()
 def user_init(qq: str) -> User:
     """
     用户初始化函数
@@ -87,16 +278,20 @@ def user_init(qq: str) -> User:
         qq=qq
         # 其他字段使用默认值
     )
-    # 添加到用户注册表
-    users[qq] = new_user
-    # 保存新用户到数据库
-    save_user(new_user)
-    return new_user
+    # 添加到用户注册表；并发的另一个指令可能已在等待数据库期间创建了该用户，此时沿用已有对象，
+    # 不能覆盖（否则对方正在修改的对象会脱离缓存，修改随之丢失）
+    user = users.setdefault(qq, new_user)
+    if user is new_user:
+        # 标记新用户待写入数据库
+        mark_dirty(new_user)
+    return user
 
-def search(qq: str) -> bool:
+@user_locks.locked()
+def search(qq: str, group_id: str = "") -> bool:
     """
     用户搜索功能
     :param qq: 用户QQ号
+    :param group_id: 发起搜索的群号，私聊为空
     :return: 搜索开始是否成功
     """
     # 根据QQ号查找用户
@@ -110,19 +305,20 @@ def search(qq: str) -> bool:
         # 当前状态不是未搜索，无法开始新搜索
         return False
     
-    # 开始搜索，修改状态和搜索开始时间
-    user.status = 1  # 设置为搜索中状态
-    user.search_start_time = int(time.time())  # 记录搜索开始时间（时间戳）
+    # 开始搜索，修改状态、搜索所在群和搜索开始时间
+    user.search_group = group_id
+    _set_status(user, 1)  # 设置为搜索中状态
+    user.search_start_time = now()  # 记录搜索开始时间（时间戳）
     
     # 重置当前搜索的物品记录
     user.inventory.clear()
     user.user_bag_items_nums = 0
     
-    # 保存用户搜索状态到数据库
-    save_user(user)
-    save_user_items(qq, user.inventory)
+    # 标记用户搜索状态待写入数据库
+    mark_dirty(user)
     return True
 
+@user_locks.locked()
 def check_status(qq: str) -> dict:
     """
     检查用户当前状态，如果处于搜索状态则执行一次搜索
@@ -155,6 +351,77 @@ def check_status(qq: str) -> dict:
     
     return result
 
+# 搜索掉落的品质权重（总和为100）
+item_quality_weights = {
+    0: 60,   # 普通 (60%)
+    1: 25,   # 稀有 (25%)
+    2: 10,   # 史诗 (10%)
+    3: 5     # 传说 (5%)
+}
+
+# 预先编译的掉落表，物品数据或权重变化后需调用 rebuild_drop_tables：
+# 先按品质权重选品质、再按物品权重选物品，等价于按 品质权重 × 物品在该品质中的占比 直接选物品
+item_drop_sampler: AliasSampler[Item] = AliasSampler([], [])
+# 每次抽取实际得到物品的概率：抽中没有物品的品质时这次抽取落空
+item_drop_chance = 0.0
+
+def rebuild_drop_tables() -> None:
+    """根据 item_quality_weights 和 items_by_quality 重新编译搜索掉落表"""
+    global item_drop_sampler, item_drop_chance
+    total_quality_weight = sum(weight for weight in item_quality_weights.values() if weight > 0)
+    items: List[Item] = []
+    weights: List[float] = []
+    hit_weight = 0
+    for quality, quality_weight in item_quality_weights.items():
+        pool = [item for item in items_by_quality.get(quality, []) if item.weight > 0]
+        if quality_weight <= 0 or not pool:
+            continue
+        hit_weight += quality_weight
+        pool_weight = sum(item.weight for item in pool)
+        for item in pool:
+            items.append(item)
+            weights.append(quality_weight * item.weight / pool_weight)
+    item_drop_sampler = AliasSampler(items, weights)
+    item_drop_chance = hit_weight / total_quality_weight if total_quality_weight else 0.0
+
+rebuild_drop_tables()
+
+def get_search_interval(user: User) -> float:
+    """
+    获取用户每抽取一件物品需要的搜索时间（包含装备加成）
+    :param user: 用户对象
+    :return: 搜索间隔（秒）
+    """
+    # 获取包含装备加成的玩家属性
+    stats = get_player_stats(user)
+    # 基础每300秒抽取一件物品，搜索时长影响搜索间隔
+    # 搜索时长为正数：增加间隔（减慢搜索），为负数：减少间隔（加快搜索）
+    # 计算公式：实际搜索间隔 = search_base_interval + search_time
+    # 最少50秒，最多1800秒（30分钟）
+    actual_interval = search_base_interval + stats.search_time
+    # 限制范围：50秒到1800秒
+    return max(50, min(1800, actual_interval))
+
+def _count_drops(draws: int, free_slots: int) -> int:
+    """draws 次抽取中实际放入背包的物品件数（背包剩余 free_slots 格，装满后不再计数）"""
+    limit = min(draws, free_slots)
+    if limit <= 0 or item_drop_chance <= 0:
+        return 0
+    if item_drop_chance >= 1:
+        return limit
+    # 部分品质没有物品时抽取可能落空：相邻两次命中之间落空的次数服从几何分布，
+    # 直接抽取下一次命中的位置，循环次数只取决于命中件数（不超过背包剩余格数），与经过的时间无关
+    log_miss = math.log(1.0 - item_drop_chance)
+    hits = 0
+    position = 0
+    while hits < limit:
+        position += int(math.log(1.0 - random.random()) / log_miss) + 1
+        if position > draws:
+            break
+        hits += 1
+    return hits
+
+@user_locks.locked()
 def extract_items_by_time(qq: str) -> List[Item]:
     """
     根据用户搜索时间进行加权物品抽取
@@ -167,87 +434,40 @@ def extract_items_by_time(qq: str) -> List[Item]:
         return user.inventory
     # 检查用户背包物品数量是否已达上限
     if user.user_bag_items_nums >= user.backpack_capacity:
-        user.search_start_time = int(time.time())
+        user.search_start_time = now()
         return user.inventory
     # 检查用户是否处于搜索中状态
     if user.status != 1:
         return user.inventory
     
-    current_time = int(time.time())
+    current_time = now()
     elapsed = current_time - user.search_start_time
     
-    # 获取包含装备加成的玩家属性
-    stats = get_player_stats(user)
-    # 基础每300秒抽取一件物品，搜索时长影响搜索间隔
-    # 搜索时长为正数：增加间隔（减慢搜索），为负数：减少间隔（加快搜索）
-    # 计算公式：实际搜索间隔 = 300 + search_time
-    # 最少50秒，最多1800秒（30分钟）
-    base_interval = 360
-    actual_interval = base_interval + stats.search_time
-    # 限制范围：50秒到1800秒
-    actual_interval = max(50, min(1800, actual_interval))
+    actual_interval = get_search_interval(user)
     
     # 每actual_interval秒抽取一件物品
     items_to_extract = int(elapsed // actual_interval)
     if items_to_extract <= 0:
         return user.inventory
     
-    # 定义品质权重（总和为100）
-    quality_weights = {
-        0: 60,   # 普通 (60%)
-        1: 25,   # 稀有 (25%)
-        2: 10,   # 史诗 (10%)
-        3: 5     # 传说 (5%)
-    }
-    
-    # 创建加权列表
-    weighted_quality_list = []
-    for quality, weight in quality_weights.items():
-        weighted_quality_list.extend([quality] * weight)
-    
-    for _ in range(items_to_extract):
-        # 随机选择品质
-        selected_quality = random.choice(weighted_quality_list)
-        
-        # 从该品质的物品列表中随机选择一个
-        quality_items = items_by_quality.get(selected_quality, [])
-        if not quality_items:
-            continue
-        
-        # 根据物品权重创建物品加权列表
-        item_weighted_list = []
-        for item in quality_items:
-            item_weighted_list.extend([item] * item.weight)
-        
-        # 随机选择物品
-        selected_item = random.choice(item_weighted_list)
-        # 创建新的Item实例以避免修改原始数据
-        new_item = Item(
-            id=selected_item.id,
-            name=selected_item.name,
-            value=selected_item.value,
-            quality=selected_item.quality,
-            weight=selected_item.weight
-        )
-
-        # 添加到用户背包
-        user.inventory.append(new_item)
-        # 更新用户背包物品数量
-        user.user_bag_items_nums += 1
-        if user.user_bag_items_nums >= user.backpack_capacity:
-            user.search_start_time = int(time.time())
-            break
+    # 背包装满后剩余的抽取不会产生效果，直接算出能放入背包的件数再一次性抽取，
+    # 长时间离线后的第一次结算和平时一样快
+    drops = _count_drops(items_to_extract, user.backpack_capacity - user.user_bag_items_nums)
+    # 物品不可变，背包中直接引用物品模板
+    user.inventory.extend(item_drop_sampler.sample_many(drops))
+    # 更新用户背包物品数量
+    user.user_bag_items_nums += drops
     
     # 更新搜索开始时间，减去已消耗的时间（保留未满一个间隔的剩余时间）
     remaining_time = elapsed % actual_interval
     user.search_start_time = current_time - remaining_time
     
-    # 保存用户数据和物品到数据库
-    save_user(user)
-    save_user_items(user.qq, user.inventory)
+    # 标记用户数据和物品待写入数据库
+    mark_dirty(user)
     
     return user.inventory
 
+@user_locks.locked()
 def retreat(qq: str) -> bool:
     """
     用户撤离功能
@@ -262,11 +482,11 @@ def retreat(qq: str) -> bool:
     if user.status != 1:
         return False
     # 设置撤离状态和撤离开始时间
-    user.status = 2
-    user.retreat_start_time = int(time.time())
+    _set_status(user, 2)
+    user.retreat_start_time = now()
     
-    # 保存用户撤离状态到数据库
-    save_user(user)
+    # 标记用户撤离状态待写入数据库
+    mark_dirty(user)
     return True
 
 def get_actual_retreat_time(user: User) -> int:
@@ -276,13 +496,13 @@ def get_actual_retreat_time(user: User) -> int:
     :return: 实际撤退时间（秒）
     """
     stats = get_player_stats(user)
-    # 基础撤退时间600秒 + 装备额外撤退时间（可正可负）
+    # 基础撤退时间 retreat_base_time（600秒） + 装备额外撤退时间（可正可负）
     # 注意：extra_retreat_time为负数时会减少撤退时间，正数时增加撤退时间
     # 最少60秒，最多1800秒
-    base_retreat_time = 600
-    actual_retreat_time = base_retreat_time + stats.extra_retreat_time-user.speed*40
+    actual_retreat_time = retreat_base_time + stats.extra_retreat_time-user.speed*40
     return int(max(60, min(1800, actual_retreat_time)))
 
+@user_locks.locked()
 def check_retreat_status(qq: str) -> int:
     """
     检查用户撤离状态
@@ -296,7 +516,7 @@ def check_retreat_status(qq: str) -> int:
     if user.status != 2:
         return -1
     # 计算撤离开始后经过的时间
-    elapsed_time = int(time.time()) - user.retreat_start_time
+    elapsed_time = now() - user.retreat_start_time
     # 获取实际撤退时间（包含装备加成）
     actual_retreat_time = get_actual_retreat_time(user)
     
@@ -308,19 +528,40 @@ def check_retreat_status(qq: str) -> int:
         # 将总价值添加到用户哈哈币中
         user.gold += total_value
         # 设置用户状态为未搜索
-        user.status = 0
+        _set_status(user, 0)
         # 重置撤离开始时间
         user.retreat_start_time = 0
         # 清空用户背包
         user.inventory.clear()
         # 重置背包物品数量
         user.user_bag_items_nums = 0
+        # 撤离通常由后台定时任务结算，记录结算结果，玩家下次查询时告知
+        user.retreat_report_value = total_value
+        user.retreat_report_time = now()
         
-        # 保存用户撤离完成状态到数据库
-        save_user(user)
+        # 标记用户撤离完成状态待写入数据库
+        mark_dirty(user)
+        _notify_retreat(user, total_value)
         return total_value
     return -1
 
+@user_locks.locked()
+def take_retreat_report(qq: str) -> Optional[Tuple[int, int]]:
+    """
+    取出尚未告知玩家的撤离结算，每次结算只会返回一次
+    :param qq: 用户QQ号（调用前需已加载用户）
+    :return: (带出物品总价值, 完成时间)，没有待告知的结算时返回 None
+    """
+    user = users.peek(qq)
+    if not user or not user.retreat_report_time:
+        return None
+    report = (user.retreat_report_value, user.retreat_report_time)
+    user.retreat_report_value = 0
+    user.retreat_report_time = 0
+    mark_dirty(user)
+    return report
+
+@user_locks.locked(2)
 def attack(attacker_qq: str, defender_qq: str) -> str:
     """
     攻击函数：进攻方攻击防守方
@@ -354,7 +595,7 @@ def attack(attacker_qq: str, defender_qq: str) -> str:
     if attacker.status != 1:
         return f"你未在搜索状态"
     # 检查是否在攻击冷却时间内
-    current_time = int(time.time())
+    current_time = now()
     # attack_cooldown_time 已经包含了上次攻击时的基础冷却 + 装备加成
     if current_time < attacker.attack_cooldown_end_time:
         remaining = attacker.attack_cooldown_end_time - current_time
@@ -373,8 +614,8 @@ def attack(attacker_qq: str, defender_qq: str) -> str:
         damage = max(10, defender.attack - attacker.defense)*2
         attacker.gold = attacker.gold - damage
         attacker.attack_cooldown_end_time = current_time + 120 + int(attacker_stats.equip_attack_cooldown)
-        # 保存进攻方数据到数据库
-        save_user(attacker)
+        # 标记进攻方数据待写入数据库
+        mark_dirty(attacker)
         return f"没打过！你损失了{damage}哈哈币。\n本次战斗成功率为{success_rate_percent:.2f}%"
 
     # 攻击成功
@@ -397,27 +638,47 @@ def attack(attacker_qq: str, defender_qq: str) -> str:
     attacker.attack_cooldown_end_time = current_time + 360 + int(attacker_stats.equip_attack_cooldown)
     
     # 设置被攻击保护时间
-    defender.attack_protection_end_time = int(time.time()) + defender_stats.attack_protection_duration
+    defender.attack_protection_end_time = now() + defender_stats.attack_protection_duration
     defender.attack_protection_end_time = current_time + defender.attack_protection_duration
     
-    # 保存进攻方和防守方的数据及物品到数据库
-    save_user(attacker)
-    save_user(defender)
-    save_user_items(attacker.qq, attacker.inventory)
-    save_user_items(defender.qq, defender.inventory)
     defender.search_start_time = current_time
+    # 标记进攻方和防守方的数据及物品待写入数据库
+    mark_dirty(attacker)
+    mark_dirty(defender)
 
     if not stolen_item:
         return f"打赢了！你损失了{damage}哈哈币。但对方背包是空的，没有抢夺到物品！\n本次战斗成功率为{success_rate_percent:.2f}%"
     else:
         msg = f"打赢了！你损失了{damage}哈哈币。抢夺到以下物品:"
-        for st in stolen_item:
-            msg += f"\n{st.name}"
+        msg += f"\n{stolen_item.name}"
         msg += f"\n本次战斗成功率为{success_rate_percent:.2f}%"
         return msg
 
 
 
+def get_attack_targets(qq: str, group: str) -> List[Tuple[str, float, int]]:
+    """
+    查询群中当前可以攻击的玩家（不含自己），只遍历目标索引中的玩家
+    :param qq: 进攻方QQ号
+    :param group: 群号
+    :return: (QQ号, 预计攻击成功率, 背包物品件数) 列表，按成功率从高到低排序
+    """
+    attacker = users.get(qq)
+    if not attacker:
+        return []
+    attacker_stats = get_player_stats(attacker)
+    result = []
+    for target_qq in targets.attackable(group, clock.time()):
+        defender = users.get(target_qq) if target_qq != qq else None
+        if not defender:
+            continue
+        # 与 attack 相同的成功率公式：进攻方攻击力 / (进攻方攻击力 + 防守方防御力)
+        defense = get_player_stats(defender).defense
+        result.append((target_qq, attacker_stats.attack / (attacker_stats.attack + defense), defender.user_bag_items_nums))
+    result.sort(key=lambda target: (-target[1], target[0]))
+    return result
+
+@user_locks.locked()
 def stop_retreat(qq: str) -> bool:
     """
     停止撤离函数：用户在撤离状态下调用，取消撤离
@@ -431,16 +692,17 @@ def stop_retreat(qq: str) -> bool:
     if user.status != 2:
         return False
     # 重置用户状态为搜索中
-    user.status = 1
+    _set_status(user, 1)
     # 重置搜索开始时间
-    user.search_start_time = int(time.time())
+    user.search_start_time = now()
     # 重置撤离开始时间
     user.retreat_start_time = 0
     
-    # 保存用户撤离完成状态到数据库
-    save_user(user)
+    # 标记用户状态待写入数据库
+    mark_dirty(user)
     return True
 
+@user_locks.locked()
 def upgrade_attribute(qq: str, attribute_tag: int, amount: int) -> tuple[bool,str]:
     """
     升级属性函数
@@ -487,19 +749,41 @@ def upgrade_attribute(qq: str, attribute_tag: int, amount: int) -> tuple[bool,st
     else:
         return False,f"输入错误，没有你要升级的属性"
 
-    # 保存用户数据到数据库
-    save_user(user)
+    # 基础属性已变化，清除缓存的最终属性
+    user.invalidate_stats()
+    # 标记用户数据待写入数据库
+    mark_dirty(user)
     return True,f"升级成功"
     return True
 
 
-def _clone_equipment_template(eq_template: Equipment) -> Equipment:
-    """返回装备模板的浅拷贝（新的 Equipment 实例）。"""
-    return Equipment(**asdict(eq_template))
+def get_economy_summary(top_n: int = 5) -> dict:
+    """
+    全服经济统计，直接在列存储上计算，不加载任何用户
+    :param top_n: 哈哈币排行返回的人数
+    :return: 包含玩家数、哈哈币总量、破产人数、状态分布、属性分布和哈哈币排行的字典
+    """
+    players, _, _, _ = player_columns.stats("gold")
+    return {
+        "players": players,
+        "total_gold": player_columns.total("gold"),
+        "broke": player_columns.count("gold", "<", 0),
+        "status": {status: player_columns.count("status", "==", status) for status in (0, 1, 2)},
+        "attack": player_columns.stats("attack"),
+        "defense": player_columns.stats("defense"),
+        "speed": player_columns.stats("speed"),
+        "backpack_capacity": player_columns.stats("backpack_capacity"),
+        "gold_distribution": player_columns.histogram("gold", (0, 5000, 20000, 100000)),
+        "top_gold": player_columns.top("gold", top_n),
+    }
+
 
+# 装备属性文本缓存：{装备id: (装备模板, 属性文本)}，由 rebuild_equipment_draw_table 按 all_equipment 重建。
+# 只有模板对象本身命中缓存，与模板数据不同的装备（旧数据）每次现算
+equipment_text_cache: Dict[str, Tuple[Equipment, str]] = {}
 
 def format_equipment_attributes(eq: Equipment) -> str:
-    """格式化装备的非默认值属性。
+    """格式化装备的非默认值属性，装备模板直接返回缓存的文本。
     
     参数:
       - eq: 装备对象
@@ -507,6 +791,13 @@ def format_equipment_attributes(eq: Equipment) -> str:
     返回:
       - 格式化的属性字符串
     """
+    cached = equipment_text_cache.get(eq.id)
+    if cached is not None and cached[0] is eq:
+        return cached[1]
+    return _render_equipment_attributes(eq)
+
+
+def _render_equipment_attributes(eq: Equipment) -> str:
     attrs = []
     
     # 检查各个属性，只显示非默认值
@@ -538,63 +829,205 @@ def format_equipment_attributes(eq: Equipment) -> str:
     return "\n".join(attrs)
 
 
+# 全装备奖池的类型权重和品质权重
+equipment_type_weights = {0: 100, 1: 100, 2: 10, 99: 1}  # 武器100，防具100，背包10，其它1
+equipment_quality_weights = {0: 70, 1: 30, 2: 10, 3: 1}  # 普通70，稀有30，史诗10，传说1
+
+# 预先编译的装备抽取表：{装备类型: {品质: 装备抽样器}}，已按品质降级规则解析好每个品质实际使用的装备池；
+# 没有任何装备的类型对应 None
+equipment_type_sampler: AliasSampler[int] = AliasSampler([], [])
+equipment_quality_sampler: AliasSampler[int] = AliasSampler([], [])
+equipment_draw_table: Dict[int, Optional[Dict[int, AliasSampler[Equipment]]]] = {}
+
+def _equipment_sampler(pool: List[Equipment]) -> AliasSampler[Equipment]:
+    return AliasSampler(pool, [max(1, int(getattr(eq, "weight", 1))) for eq in pool])
+
+def rebuild_equipment_draw_table() -> None:
+    """根据 all_equipment 和类型、品质权重重新编译全装备奖池，并重建装备属性文本缓存"""
+    global equipment_type_sampler, equipment_quality_sampler, equipment_draw_table, equipment_text_cache
+    index: Dict[Tuple[int, int], List[Equipment]] = {}
+    for eq in all_equipment:
+        key = (getattr(eq, "equipment_type", 99), getattr(eq, "quality", 0))
+        index.setdefault(key, []).append(eq)
+
+    draw_table: Dict[int, Optional[Dict[int, AliasSampler[Equipment]]]] = {}
+    for eq_type in equipment_type_weights:
+        type_pool = [eq for eq in all_equipment if getattr(eq, "equipment_type", 99) == eq_type]
+        if not type_pool:
+            draw_table[eq_type] = None
+            continue
+        # 该稀有度没有装备时降级到普通品质，仍然没有则使用整个type池
+        type_sampler = _equipment_sampler(type_pool)
+        common_pool = index.get((eq_type, 0))
+        common_sampler = _equipment_sampler(common_pool) if common_pool else type_sampler
+        draw_table[eq_type] = {
+            quality: _equipment_sampler(index[(eq_type, quality)]) if index.get((eq_type, quality)) else common_sampler
+            for quality in equipment_quality_weights
+        }
+
+    equipment_type_sampler = AliasSampler(list(equipment_type_weights), list(equipment_type_weights.values()))
+    equipment_quality_sampler = AliasSampler(list(equipment_quality_weights), list(equipment_quality_weights.values()))
+    equipment_draw_table = draw_table
+    equipment_text_cache = {eq.id: (eq, _render_equipment_attributes(eq)) for eq in all_equipment}
+
+rebuild_equipment_draw_table()
+
 def draw_equipment_from_all_pool() -> Equipment:
     """从全装备奖池中抽取一件装备，分步判定：1.type权重 → 2.quality权重 → 3.装备自身权重。"""
-    from .equipment_data import all_equipment
-    
     # 第1步：根据type权重确定装备类型
-    type_weight_map = {0: 100, 1: 100, 2: 10, 99: 1}  # 武器100，防具100，背包10，其它1
-    type_weighted_list = []
-    for eq_type, weight in type_weight_map.items():
-        type_weighted_list.extend([eq_type] * weight)
-    selected_type = random.choice(type_weighted_list)
-    
-    # 筛选出该type的所有装备
-    type_pool = [eq for eq in all_equipment if getattr(eq, "equipment_type", 99) == selected_type]
-    if not type_pool:
+    quality_samplers = equipment_draw_table.get(equipment_type_sampler.sample())
+    if not quality_samplers:
         return None
-    
-    # 第2步：根据quality权重确定稀有度
-    quality_weight_map = {0: 70, 1: 30, 2: 10, 3: 1}  # 普通70，稀有30，史诗10，传说1
-    quality_weighted_list = []
-    for quality, weight in quality_weight_map.items():
-        quality_weighted_list.extend([quality] * weight)
-    selected_quality = random.choice(quality_weighted_list)
-    
-    # 筛选出该type+quality的所有装备
-    quality_pool = [eq for eq in type_pool if getattr(eq, "quality", 0) == selected_quality]
-    if not quality_pool:
-        # 如果该稀有度没有装备，降级到普通品质
-        quality_pool = [eq for eq in type_pool if getattr(eq, "quality", 0) == 0]
-        if not quality_pool:
-            # 仍然没有则从type池随机
-            quality_pool = type_pool
-    
-    # 第3步：根据装备自身权重随机抽取
-    equipment_weighted_list = []
-    for eq in quality_pool:
-        base_weight = max(1, int(getattr(eq, "weight", 1)))
-        equipment_weighted_list.extend([eq] * base_weight)
-    
-    selected = random.choice(equipment_weighted_list)
-    return _clone_equipment_template(selected)
+    # 第2步：根据quality权重确定稀有度；第3步：根据装备自身权重随机抽取
+    # 装备不可变，玩家直接持有共享的模板对象
+    return quality_samplers[equipment_quality_sampler.sample()].sample()
+
+def draw_equipments_from_all_pool(count: int) -> List[Equipment]:
+    """从全装备奖池中一次抽取 count 件装备，类型和品质各做一次批量抽样；抽中没有装备的类型时该次落空"""
+    types = equipment_type_sampler.sample_many(count)
+    qualities = equipment_quality_sampler.sample_many(count)
+    result = []
+    for eq_type, quality in zip(types, qualities):
+        quality_samplers = equipment_draw_table.get(eq_type)
+        if quality_samplers:
+            result.append(quality_samplers[quality].sample())
+    return result
 
 
+@user_locks.locked()
 def draw_equipment_for_purchase(qq: str) -> Tuple[bool, str, Equipment]:
-    """抽奖消耗5000哈哈币，从全type奖池抽取装备。"""
+    """抽奖消耗 equipment_draw_cost（5000）哈哈币，从全type奖池抽取装备。"""
     user = users.get(qq)
     if not user:
         user = user_init(qq)
-    cost = 5000
+    cost = equipment_draw_cost
     if user.gold < cost:
         return False, f"哈哈币不足，无法抽奖！当前哈哈币：{user.gold}，需要：{cost}", None
     new_eq = draw_equipment_from_all_pool()
     if not new_eq:
         return False, "奖池为空，无法抽取！", None
-    # 扣除哈哈币并保存
+    # 扣除哈哈币并标记待写入
     user.gold -= cost
-    save_user(user)
-    from .game_core import format_equipment_attributes
+    mark_dirty(user)
     attr_str = format_equipment_attributes(new_eq)
     msg = f"抽到装备：{new_eq.name}\n{attr_str}\n价值：{new_eq.value}哈哈币"
     return True, msg, new_eq
+
+
+@user_locks.locked()
+def draw_equipment_batch_for_purchase(qq: str, count: int, keep_quality: Optional[int]) -> Tuple[bool, str, List[Tuple[Equipment, bool]]]:
+    """
+    多连抽：批量抽取 count 件装备，一次扣除哈哈币，按 keep_quality 一次性决定存入仓库或出售，
+    整个结果只标记一次待写入，由写回队列在同一个事务中写入数据库
+    :param qq: 用户QQ号
+    :param count: 抽取次数
+    :param keep_quality: 品质不低于该值的装备存入仓库（仓库放不下时优先保留品质、价值高的），其余出售；None 表示全部出售
+    :return: (是否成功, 提示信息, [(装备, 是否存入仓库)])
+    """
+    user = users.get(qq)
+    if not user:
+        user = user_init(qq)
+    cost = equipment_draw_cost * count
+    if user.gold < cost:
+        return False, f"哈哈币不足，无法{count}连抽！当前哈哈币：{user.gold}，需要：{cost}", []
+    drawn = draw_equipments_from_all_pool(count)
+    if not drawn:
+        return False, "奖池为空，无法抽取！", []
+    # 落空的抽取不扣费，与单抽一致
+    cost = equipment_draw_cost * len(drawn)
+
+    free_slots = max(0, equipment_storage_capacity - len(user.equipment_storage))
+    candidates = [] if keep_quality is None else [i for i, eq in enumerate(drawn) if eq.quality >= keep_quality]
+    candidates.sort(key=lambda i: (drawn[i].quality, drawn[i].value), reverse=True)
+    kept = set(candidates[:free_slots])
+    results = [(eq, i in kept) for i, eq in enumerate(drawn)]
+    income = sum(eq.value for eq, stored in results if not stored)
+
+    user.equipment_storage.extend(eq for eq, stored in results if stored)
+    user.gold += income - cost
+    mark_dirty(user)
+    msg = f"{len(drawn)}连抽花费{cost}哈哈币，存入仓库{len(kept)}件，出售{len(drawn) - len(kept)}件获得{income}哈哈币\n当前哈哈币：{user.gold}"
+    return True, msg, results
+
+
+# ==================== 异步接口（供 NoneBot 事件处理器使用）====================
+# 需要读数据库的部分通过 async_db 在专用线程中执行，游戏逻辑本身只操作内存并交给写回队列持久化，
+# 因此事件处理器 await 这些函数时不会阻塞事件循环
+
+async def get_user_async(qq: str) -> Optional[User]:
+    """获取用户：缓存中没有时在数据库线程中加载，数据库中也没有则返回 None"""
+    user = users.peek(qq)
+    if user is None:
+        user = await async_db.load_user(qq)
+        if user is not None:
+            user = users.setdefault(qq, user)
+    return user
+
+async def get_or_init_user_async(qq: str) -> User:
+    """获取用户，不存在时初始化"""
+    user = await get_user_async(qq)
+    return user if user is not None else user_init(qq)
+
+# 以下异步版本先在数据库线程中预加载用户，再调用同步版本（此时只访问缓存）。
+# 数据库中没有的用户不能交给同步版本处理：其中的 users.get 会在事件循环线程里再查一次数据库，
+# 因此需要初始化的指令先初始化，其余指令直接返回同步版本对不存在用户的结果
+
+async def search_async(qq: str, group_id: str = "") -> bool:
+    """search 的异步版本"""
+    await get_or_init_user_async(qq)
+    return search(qq, group_id)
+
+async def check_status_async(qq: str) -> dict:
+    """check_status 的异步版本"""
+    await get_or_init_user_async(qq)
+    return check_status(qq)
+
+async def check_retreat_status_async(qq: str) -> int:
+    """check_retreat_status 的异步版本"""
+    if await get_user_async(qq) is None:
+        return -1
+    return check_retreat_status(qq)
+
+async def retreat_async(qq: str) -> bool:
+    """retreat 的异步版本"""
+    if await get_user_async(qq) is None:
+        return False
+    return retreat(qq)
+
+async def stop_retreat_async(qq: str) -> bool:
+    """stop_retreat 的异步版本"""
+    if await get_user_async(qq) is None:
+        return False
+    return stop_retreat(qq)
+
+async def attack_async(attacker_qq: str, defender_qq: str) -> str:
+    """attack 的异步版本"""
+    if await get_user_async(attacker_qq) is None:
+        user_init(attacker_qq)
+        return f"你未在搜索状态"
+    if await get_user_async(defender_qq) is None:
+        return f"目标不存在"
+    return attack(attacker_qq, defender_qq)
+
+async def get_attack_targets_async(qq: str, group: str) -> List[Tuple[str, float, int]]:
+    """get_attack_targets 的异步版本，不在缓存中的目标通过异步数据库加载"""
+    if await get_user_async(qq) is None:
+        return []
+    for target_qq in targets.attackable(group, clock.time()):
+        await get_user_async(target_qq)
+    return get_attack_targets(qq, group)
+
+async def upgrade_attribute_async(qq: str, attribute_tag: int, amount: int) -> tuple[bool,str]:
+    """upgrade_attribute 的异步版本"""
+    await get_or_init_user_async(qq)
+    return upgrade_attribute(qq, attribute_tag, amount)
+
+async def draw_equipment_for_purchase_async(qq: str) -> Tuple[bool, str, Equipment]:
+    """draw_equipment_for_purchase 的异步版本"""
+    await get_or_init_user_async(qq)
+    return draw_equipment_for_purchase(qq)
+
+async def draw_equipment_batch_for_purchase_async(qq: str, count: int, keep_quality: Optional[int]) -> Tuple[bool, str, List[Tuple[Equipment, bool]]]:
+    """draw_equipment_batch_for_purchase 的异步版本"""
+    await get_or_init_user_async(qq)
+    return draw_equipment_batch_for_purchase(qq, count, keep_quality)
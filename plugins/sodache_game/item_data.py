@@ -1,3 +1,4 @@
+from typing import Dict, Tuple
 from .models.game_models import Item
 
 # 普通物品列表（quality=0）
@@ -81,4 +82,6 @@ items_by_quality = {
     1: rare_items,
     2: epic_items,
     3: legendary_items
-}
\ No newline at end of file
+}
+# 按 (物品id, 名称) 索引的物品模板（物品id并不唯一），从数据库加载背包时直接复用模板对象
+item_by_key: Dict[Tuple[str, str], Item] = {(item.id, item.name): item for item in all_items}
@@ -0,0 +1,214 @@
+"""
+数据库结构迁移
+schema_version 表记录当前结构版本，MIGRATIONS 中版本号更大的步骤按顺序各执行一次，
+每个步骤在独立事务中完成。新增字段请追加新步骤并使用 ALTER TABLE ... ADD COLUMN，
+只有确实需要重建表时才使用 copy_in_batches 分批复制数据。
+"""
+
+import sqlite3
+from typing import Callable, List, Sequence, Tuple
+from .utils.equipment_codec import PERSISTED_FIELDS, diff_from_template
+
+BATCH_SIZE = 5000  # 分批复制数据时每批的行数
+
+
+def copy_in_batches(conn: sqlite3.Connection, source: str, target: str, columns: Sequence[str],
+                    batch_size: int = BATCH_SIZE) -> int:
+    """按 rowid 分批把 source 表的数据复制到 target 表，返回复制的行数"""
+    column_list = ", ".join(columns)
+    copied = 0
+    last_rowid = -1
+    while True:
+        row = conn.execute(
+            f"SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {source} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, batch_size)
+        ).fetchone()
+        if not row[1]:
+            return copied
+        conn.execute(
+            f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {source} WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+            (last_rowid, row[0])
+        )
+        copied += row[1]
+        last_rowid = row[0]
+
+
+def _create_base_tables(conn: sqlite3.Connection) -> None:
+    # 创建用户表
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        qq TEXT PRIMARY KEY,
+        attack INTEGER DEFAULT 10,
+        defense INTEGER DEFAULT 5,
+        luck INTEGER DEFAULT 0,
+        speed INTEGER DEFAULT 0,
+        search_time INTEGER DEFAULT 0,
+        gold INTEGER DEFAULT 100,
+        status INTEGER DEFAULT 0,
+        search_start_time INTEGER DEFAULT 0,
+        attack_cooldown_start INTEGER DEFAULT 0,
+        retreat_start_time INTEGER DEFAULT 0,
+        search_group TEXT DEFAULT '',
+        user_bag_items_nums INTEGER DEFAULT 0,
+        have_searched_nums INTEGER DEFAULT 0,
+        attack_cooldown_end_time INTEGER DEFAULT 0,
+        backpack_capacity INTEGER DEFAULT 4,
+        attack_protection_end_time INTEGER DEFAULT 0
+    )
+    """)
+    # 创建用户装备表和装备仓库表
+    for table in ("user_equipment", "user_equipment_storage"):
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_qq TEXT,
+            item_id TEXT,
+            item_name TEXT,
+            item_value INTEGER,
+            item_quality INTEGER,
+            equipment_type INTEGER DEFAULT 99,
+            add_to_attack INTEGER DEFAULT 0,
+            add_to_defense INTEGER DEFAULT 0,
+            increase_attack INTEGER DEFAULT 0,
+            increase_defense INTEGER DEFAULT 0,
+            equip_luck INTEGER DEFAULT 0,
+            extra_search_time INTEGER DEFAULT 0,
+            extra_retreat_time INTEGER DEFAULT 0,
+            equip_attack_cooldown INTEGER DEFAULT 0,
+            extra_backpack_capacity INTEGER DEFAULT 0,
+            extra_attack_protection_duration INTEGER DEFAULT 0
+        )
+        """)
+
+
+def _create_user_items(conn: sqlite3.Connection) -> None:
+    """创建带自增 id 的 user_items 表；早期版本的表没有 id 列，需要重建并复制数据"""
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(user_items)").fetchall()]
+    if "id" in columns:
+        return
+
+    conn.execute("""
+    CREATE TABLE user_items_temp (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_qq TEXT,
+        item_id TEXT,
+        item_name TEXT,
+        item_value INTEGER,
+        item_quality INTEGER
+    )
+    """)
+    if columns:
+        # 旧表存在，分批复制数据到新表后删除旧表
+        copy_in_batches(conn, "user_items", "user_items_temp",
+                        ("user_qq", "item_id", "item_name", "item_value", "item_quality"))
+        conn.execute("DROP TABLE user_items")
+    conn.execute("ALTER TABLE user_items_temp RENAME TO user_items")
+
+
+def _create_user_qq_indexes(conn: sqlite3.Connection) -> None:
+    # 为user_qq字段创建索引，提高查询效率
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_items_qq ON user_items(user_qq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_equipment_qq ON user_equipment(user_qq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_equipment_storage_qq ON user_equipment_storage(user_qq)")
+
+
+def _create_active_status_index(conn: sqlite3.Connection) -> None:
+    # 只索引正在搜索或撤离的用户（绝大多数用户处于空闲状态），包含 qq 列以免回表
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_active_status ON users(status, search_group, qq) WHERE status != 0")
+
+
+# 旧版装备表中与 PERSISTED_FIELDS 对应的列名（name/value/quality 带 item_ 前缀）
+_WIDE_EQUIPMENT_COLUMNS = (
+    "item_name", "item_value", "item_quality", "equipment_type",
+    "add_to_attack", "add_to_defense", "increase_attack", "increase_defense",
+    "equip_luck", "extra_search_time", "extra_retreat_time", "equip_attack_cooldown",
+    "extra_backpack_capacity", "extra_attack_protection_duration",
+)
+
+
+def _compact_equipment_tables(conn: sqlite3.Connection, batch_size: int = BATCH_SIZE) -> None:
+    """装备表只保存装备id和相对模板的差异（overrides，JSON），其余属性加载时从 equipment_data 还原"""
+    select_columns = ", ".join(("id", "user_qq", "item_id") + _WIDE_EQUIPMENT_COLUMNS)
+    for table in ("user_equipment", "user_equipment_storage"):
+        conn.execute(f"""
+        CREATE TABLE {table}_compact (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_qq TEXT,
+            item_id TEXT,
+            overrides TEXT
+        )
+        """)
+        # 需要逐行计算差异，无法用 copy_in_batches，按 id 分批在 Python 中转换；保留原行id
+        last_id = -1
+        while True:
+            rows = conn.execute(
+                f"SELECT {select_columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany(
+                f"INSERT INTO {table}_compact (id, user_qq, item_id, overrides) VALUES (?, ?, ?, ?)",
+                [(row[0], row[1], row[2], diff_from_template(row[2], dict(zip(PERSISTED_FIELDS, row[3:]))))
+                 for row in rows]
+            )
+            last_id = rows[-1][0]
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_compact RENAME TO {table}")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_qq ON {table}(user_qq)")
+
+
+def _add_retreat_report_columns(conn: sqlite3.Connection) -> None:
+    # 撤离由后台定时任务结算后，结算结果保存到玩家下次查询时再告知
+    conn.execute("ALTER TABLE users ADD COLUMN retreat_report_value INTEGER DEFAULT 0")
+    conn.execute("ALTER TABLE users ADD COLUMN retreat_report_time INTEGER DEFAULT 0")
+
+
+# (版本号, 说明, 迁移函数)，版本号必须递增；已发布的步骤不要修改，只能追加
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "创建用户表、装备表和装备仓库表", _create_base_tables),
+    (2, "创建 user_items 表（旧表补充自增 id 列）", _create_user_items),
+    (3, "为 user_qq 字段创建索引", _create_user_qq_indexes),
+    (4, "为搜索中和撤离中的用户创建部分索引", _create_active_status_index),
+    (5, "装备表改为只保存装备id和相对模板的差异", _compact_equipment_tables),
+    (6, "用户表增加尚未告知的撤离结算", _add_retreat_report_columns),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """读取当前结构版本，尚未建立版本表的数据库视为版本 0"""
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """执行所有尚未执行的迁移步骤，返回迁移后的版本号"""
+    version = get_schema_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    conn.commit()
+    for step_version, _, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 加写锁后再确认一次，避免多个进程重复执行同一步骤
+            if get_schema_version(conn) >= step_version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute("DELETE FROM schema_version")
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (step_version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = step_version
+    return version
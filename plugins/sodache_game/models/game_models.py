@@ -1,8 +1,11 @@
+import sys
 from dataclasses import dataclass, field
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Tuple
 from enum import IntEnum
 
+# 物品和装备数量多，Python 3.10+ 上使用 __slots__ 减少每个对象的内存
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 class EquipmentType(IntEnum):
     """装备类型枚举"""
     WEAPON = 0      # 武器
@@ -11,8 +14,9 @@ class EquipmentType(IntEnum):
     ACCESSORY = 3   # 饰品
     OTHER = 99      # 其他
 
-class PlayerStats(BaseModel):
-    """最终结算属性"""
+@dataclass(frozen=True)
+class PlayerStats:
+    """最终结算属性（只读，缓存在 User 上，装备或属性变化时重新计算）"""
     qq: str
     attack: float = 10.0
     defense: float = 5.0
@@ -23,9 +27,9 @@ class PlayerStats(BaseModel):
     attack_protection_duration: float = 180.0
     extra_retreat_time: float = 0.0
 
-@dataclass
+@dataclass(frozen=True, **_SLOTS)
 class Item:
-    """物品类"""
+    """物品类（不可变：背包中直接引用 item_data 中的模板对象，多个用户共享同一个实例）"""
     id: str                      # 物品唯一标识
     name: str                    # 物品名称
     value: int                   # 物品价值
@@ -58,6 +62,16 @@ class User:
     backpack_capacity: int = 4        # 背包容量
     attack_protection_end_time: int = 0  # 被攻击保护结束时间
     attack_protection_duration: int = 180 # 被攻击保护时长（秒）
+    retreat_report_value: int = 0     # 尚未告知玩家的撤离结算：带出物品总价值
+    retreat_report_time: int = 0      # 尚未告知玩家的撤离结算：完成时间，0 表示没有待告知的结算
+    # 已写入数据库的行：表名 -> {id(对象): (对象, [行id])}，由 db 模块维护，用于增量保存
+    persisted_rows: Dict[str, Dict[int, Tuple[Any, List[int]]]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # 缓存的最终结算属性，由 get_player_stats 计算，装备或基础属性变化后需调用 invalidate_stats
+    stats_cache: Optional[PlayerStats] = field(default=None, init=False, repr=False, compare=False)
+
+    def invalidate_stats(self) -> None:
+        """清除缓存的最终结算属性，下次读取时重新计算"""
+        self.stats_cache = None
 
     def equip_item(self, eq: "Equipment") -> bool:
         """装备一个 `Equipment` 实例：
@@ -70,6 +84,7 @@ class User:
 
         # 添加装备
         self.equipment.append(eq)
+        self.invalidate_stats()
         return True
 
     def unequip_item(self, eq_identifier) -> bool:
@@ -95,11 +110,12 @@ class User:
         except ValueError:
             return False
 
+        self.invalidate_stats()
         return True
 
-@dataclass
+@dataclass(frozen=True, **_SLOTS)
 class Equipment(Item):
-    """装备类 — 继承自 物品类"""
+    """装备类 — 继承自 物品类（不可变，未改动属性的装备直接引用 equipment_data 中的模板）"""
     equipment_type: int = 99                    # 装备类型：0=武器, 1=防具, 2=背包, 3=饰品, 99=其他（使用EquipmentType枚举）
     add_to_attack: int = 0                      # 直接增加攻击力
     increase_attack: int = 0                    # 提高攻击力百分比
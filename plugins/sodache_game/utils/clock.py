@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class SystemClock:
+    """真实时钟"""
+
+    def time(self) -> float:
+        """当前时间戳（秒）"""
+        return time.time()
+
+
+class ManualClock:
+    """手动推进的时钟，用于基准测试和模拟：时间只在调用 advance 或 set 时变化"""
+
+    def __init__(self, start: float = 0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        """当前时间戳（秒）"""
+        with self._lock:
+            return self._now
+
+    def advance(self, seconds: float) -> float:
+        """向前推进 seconds 秒，返回推进后的时间"""
+        if seconds < 0:
+            raise ValueError("时钟不能倒退")
+        with self._lock:
+            self._now += seconds
+            return self._now
+
+    def set(self, timestamp: float) -> None:
+        """直接设置当前时间（不能早于当前时间）"""
+        with self._lock:
+            if timestamp < self._now:
+                raise ValueError("时钟不能倒退")
+            self._now = float(timestamp)
@@ -1,40 +1,155 @@
 import sqlite3
-from typing import List, Optional
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, List, Optional
+
+@dataclass
+class PoolStats:
+    """连接池计数器"""
+    checkouts: int = 0   # 借出连接次数
+    creations: int = 0   # 新建连接次数
+    waits: int = 0       # 因连接耗尽而等待的次数
+    discarded: int = 0   # 健康检查失败被丢弃的连接数
 
 class ConnectionPool:
-    """A simple SQLite connection pool"""
-    
-    def __init__(self, db_path: str, pool_size: int = 5, timeout: int = 5):
+    """A thread-safe bounded SQLite connection pool"""
+
+    def __init__(self, db_path: str, pool_size: int = 5, timeout: int = 5,
+                 wait_timeout: float = 10.0, pragmas: Optional[Dict[str, object]] = None):
         """
         初始化连接池
-        
+
         参数:
         - db_path: 数据库文件路径
-        - pool_size: 连接池大小，默认5
+        - pool_size: 最多同时打开的连接数，默认5
         - timeout: 数据库操作超时时间（秒），默认5
+        - wait_timeout: 连接耗尽时等待归还的最长时间（秒），默认10
+        - pragmas: 每个新连接创建后执行的 PRAGMA，如 {"journal_mode": "WAL"}
         """
         self.db_path = db_path
         self.pool_size = pool_size
         self.timeout = timeout
-        self.connections: List[sqlite3.Connection] = []
-    
+        self.wait_timeout = wait_timeout
+        self.pragmas = dict(pragmas or {})
+        self.connections: List[sqlite3.Connection] = []  # 空闲连接
+        self._open_count = 0  # 已打开（空闲 + 借出）的连接数
+        self._stats = PoolStats()
+        self._cond = threading.Condition()
+
+    @property
+    def stats(self) -> PoolStats:
+        """当前计数器的快照"""
+        with self._cond:
+            return replace(self._stats)
+
+    def _create_conn(self) -> sqlite3.Connection:
+        # 连接会在执行器线程之间传递，由连接池保证同一时间只有一个线程使用
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        try:
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name}={value}")
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
     def get_conn(self) -> sqlite3.Connection:
-        """从连接池获取一个数据库连接"""
-        if self.connections:
-            return self.connections.pop()
-        # 如果连接池为空，创建新连接
-        return sqlite3.connect(self.db_path, timeout=self.timeout)
-    
+        """从连接池获取一个数据库连接，连接耗尽时最多等待 wait_timeout 秒"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._cond:
+                waited = False
+                while not self.connections and self._open_count >= self.pool_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"等待数据库连接超时（{self.wait_timeout}秒），连接池已耗尽")
+                    if not waited:
+                        self._stats.waits += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                if self.connections:
+                    conn = self.connections.pop()
+                else:
+                    conn = None
+                    self._open_count += 1
+
+            if conn is None:
+                # 在锁外创建新连接，避免阻塞其他线程归还连接
+                try:
+                    conn = self._create_conn()
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._stats.creations += 1
+                    self._stats.checkouts += 1
+                return conn
+
+            if self._is_healthy(conn):
+                with self._cond:
+                    self._stats.checkouts += 1
+                return conn
+            # 连接已失效，丢弃后重新获取
+            self.discard_conn(conn)
+
     def put_conn(self, conn: sqlite3.Connection) -> None:
-        """将连接放回连接池"""
-        if len(self.connections) < self.pool_size:
+        """将连接放回连接池，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard_conn(conn)
+            return
+        with self._cond:
             self.connections.append(conn)
-        else:
-            # 如果连接池已满，关闭该连接
+            self._cond.notify()
+
+    def discard_conn(self, conn: sqlite3.Connection) -> None:
+        """关闭一个借出的失效连接，并释放其占用的名额"""
+        try:
             conn.close()
-    
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._stats.discarded += 1
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._open_count -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """借出一个连接：正常结束时提交，发生异常时回滚，最后总会归还"""
+        conn = self.get_conn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            self.put_conn(conn)
+
     def close_all(self) -> None:
-        """关闭连接池中的所有连接"""
-        for conn in self.connections:
-            conn.close()
-        self.connections.clear()
\ No newline at end of file
+        """关闭连接池中的所有空闲连接"""
+        with self._cond:
+            for conn in self.connections:
+                conn.close()
+            self._open_count -= len(self.connections)
+            self.connections.clear()
+            self._cond.notify_all()
@@ -0,0 +1,48 @@
+import json
+from dataclasses import replace
+from typing import Any, Dict, Optional
+from ..models.game_models import Equipment
+from ..equipment_data import equipment_by_id
+
+# 需要持久化的装备属性（id 单独保存在 item_id 列）
+PERSISTED_FIELDS = (
+    "name", "value", "quality", "equipment_type",
+    "add_to_attack", "add_to_defense", "increase_attack", "increase_defense",
+    "equip_luck", "extra_search_time", "extra_retreat_time", "equip_attack_cooldown",
+    "extra_backpack_capacity", "extra_attack_protection_duration",
+)
+
+
+def diff_from_template(item_id: str, values: Dict[str, Any]) -> Optional[str]:
+    """
+    计算装备属性相对装备模板的差异，返回 JSON 字符串；与模板完全一致时返回 None
+
+    模板不存在（装备已从 equipment_data 中删除）时保存全部属性，保证仍能还原
+    """
+    template = equipment_by_id.get(item_id)
+    if template is None:
+        overrides = {name: values[name] for name in PERSISTED_FIELDS if name in values}
+    else:
+        overrides = {name: values[name] for name in PERSISTED_FIELDS
+                     if name in values and values[name] != getattr(template, name)}
+    if not overrides:
+        return None
+    return json.dumps(overrides, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_overrides(eq: Equipment) -> Optional[str]:
+    """装备对象 -> overrides 列的值"""
+    return diff_from_template(eq.id, {name: getattr(eq, name) for name in PERSISTED_FIELDS})
+
+
+def decode_equipment(item_id: str, overrides: Optional[str]) -> Equipment:
+    """根据装备id和 overrides 列还原装备对象，没有差异时直接返回共享的模板对象"""
+    template = equipment_by_id.get(item_id)
+    if template is not None and not overrides:
+        return template
+    values = json.loads(overrides) if overrides else {}
+    if template is None:
+        values.setdefault("name", item_id)
+        values.setdefault("value", 0)
+        return Equipment(id=item_id, **values)
+    return replace(template, **values)
@@ -0,0 +1,244 @@
+import random
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_MAX_LEVEL = 32  # 跳表最高层数，足够容纳 2^32 个元素
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        # width[i] 为第 i 层跳到 next[i] 时越过的元素个数（next[i] 为空时视为跳到表尾之后）
+        self.width: List[int] = [1] * level
+
+
+class IndexableSkipList:
+    """
+    可按下标访问的有序跳表：插入、删除、按键查排名都是 O(log n)，
+    从任意排名开始取 k 个元素为 O(log n + k)，由已排序的键批量构建为 O(n)
+    """
+
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVEL)
+        self._size = 0
+        self._level = 1  # 当前使用的层数，只遍历这些层；更高的层为空，表头在这些层的宽度不维护
+
+    @classmethod
+    def from_sorted(cls, keys: Iterable[Any]) -> "IndexableSkipList":
+        """由按升序排列的键直接构建跳表（逐个追加到各层末尾，不需要查找），键未排序时抛出 ValueError"""
+        skiplist = cls()
+        tails: List[_Node] = [skiplist._head] * _MAX_LEVEL  # 每一层当前的最后一个节点
+        tail_positions = [0] * _MAX_LEVEL                    # 这些节点的位置（表头为0，第一个元素为1）
+        position = 0
+        previous = None
+        for key in keys:
+            if position and key < previous:
+                raise ValueError("from_sorted 需要按升序排列的键")
+            previous = key
+            position += 1
+            # 批量构建时不需要随机：第 p 个元素的层数取 p 的最低位1所在的位置，各层间隔均匀，与随机层数的期望分布相同
+            level_count = (position & -position).bit_length()
+            node = _Node(key, level_count if level_count < _MAX_LEVEL else _MAX_LEVEL)
+            if level_count == 1:
+                # 一半的元素只有一层，单独处理以加快构建
+                tail = tails[0]
+                tail.next[0] = node
+                tail.width[0] = position - tail_positions[0]
+                tails[0] = node
+                tail_positions[0] = position
+                continue
+            for level in range(len(node.next)):
+                tails[level].next[level] = node
+                tails[level].width[level] = position - tail_positions[level]
+                tails[level] = node
+                tail_positions[level] = position
+            if len(node.next) > skiplist._level:
+                skiplist._level = len(node.next)
+        # 各层最后一个节点跳到表尾之后
+        for level in range(skiplist._level):
+            tails[level].width[level] = position + 1 - tail_positions[level]
+        skiplist._size = position
+        return skiplist
+
+    @staticmethod
+    def _random_level() -> int:
+        # 层数 = 随机数最低位的1所在的位置，取 k 层的概率为 1/2^k（全为0时取最高层）
+        bits = random.getrandbits(_MAX_LEVEL - 1)
+        return (bits & -bits).bit_length() or _MAX_LEVEL
+
+    def _find_chain(self, key: Any) -> Tuple[List[_Node], List[int]]:
+        """每一层最后一个小于 key 的节点，以及在该层前进时越过的元素个数（未使用的层为表头和0）"""
+        chain: List[_Node] = [self._head] * _MAX_LEVEL
+        steps = [0] * _MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key: Any) -> None:
+        """插入一个键（允许重复）"""
+        chain, steps_at_level = self._find_chain(key)
+        level_count = self._random_level()
+        if level_count > self._level:
+            # 启用新的层：表头在这些层直接跳到表尾之后
+            for level in range(self._level, level_count):
+                self._head.width[level] = self._size + 1
+            self._level = level_count
+        new_node = _Node(key, level_count)
+        steps = 0
+        for level in range(level_count):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(level_count, self._level):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any) -> None:
+        """删除一个键，不存在时抛出 KeyError"""
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self._level):
+            chain[level].width[level] -= 1
+        self._size -= 1
+        # 最高的层已经没有节点时不再遍历
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    def index(self, key: Any) -> int:
+        """键的下标（从0开始），不存在时抛出 KeyError"""
+        chain, steps = self._find_chain(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return sum(steps)
+
+    def slice(self, start: int, count: int) -> List[Any]:
+        """从下标 start 开始的最多 count 个键"""
+        if start < 0 or start >= self._size or count <= 0:
+            return []
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class GoldLeaderboard:
+    """
+    哈哈币排行榜：全服一张跳表，每个群一张跳表（玩家归入最近一次搜索所在的群，私聊搜索不计入群榜）。
+    键为 (-哈哈币, QQ号)，哈哈币相同时按QQ号排序，排名稳定
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[int, str]] = {}  # qq -> (哈哈币, 群)
+        self._global = IndexableSkipList()
+        self._groups: Dict[str, IndexableSkipList] = {}
+        self._lock = threading.RLock()
+
+    def load(self, rows: Iterable[Tuple[str, int, str]]) -> None:
+        """
+        用 (QQ号, 哈哈币, 群) 一次性重建排行榜，O(n)；
+        rows 需按哈哈币降序、QQ号升序排列（即键 (-哈哈币, QQ号) 的升序），可直接由 SQL 排序
+        """
+        entries: Dict[str, Tuple[int, str]] = {}
+        global_keys = []
+        group_keys: Dict[str, list] = {}
+        for qq, gold, group in rows:
+            key = (-gold, qq)
+            entries[qq] = (gold, group)
+            global_keys.append(key)
+            if group:
+                group_keys.setdefault(group, []).append(key)
+        with self._lock:
+            self._entries = entries
+            self._global = IndexableSkipList.from_sorted(global_keys)
+            self._groups = {group: IndexableSkipList.from_sorted(keys) for group, keys in group_keys.items()}
+
+    def update(self, qq: str, gold: int, group: str = "") -> None:
+        """同步一个玩家的哈哈币和所在群，没有变化时不做任何操作"""
+        with self._lock:
+            entry = self._entries.get(qq)
+            if entry == (gold, group):
+                return
+            if entry is not None:
+                self._remove_entry(qq, entry)
+            self._entries[qq] = (gold, group)
+            key = (-gold, qq)
+            self._global.insert(key)
+            if group:
+                self._groups.setdefault(group, IndexableSkipList()).insert(key)
+
+    def remove(self, qq: str) -> None:
+        """从排行榜中移除玩家"""
+        with self._lock:
+            entry = self._entries.pop(qq, None)
+            if entry is not None:
+                self._remove_entry(qq, entry)
+
+    def _remove_entry(self, qq: str, entry: Tuple[int, str]) -> None:
+        gold, group = entry
+        key = (-gold, qq)
+        self._global.remove(key)
+        if group:
+            board = self._groups[group]
+            board.remove(key)
+            if not board:
+                del self._groups[group]
+
+    def _board(self, group: Optional[str]) -> Optional[IndexableSkipList]:
+        return self._global if group is None else self._groups.get(group)
+
+    def rank(self, qq: str, group: Optional[str] = None) -> Optional[int]:
+        """玩家的名次（从1开始），group 为 None 时为全服排名；不在榜上时返回 None"""
+        with self._lock:
+            entry = self._entries.get(qq)
+            if entry is None or (group is not None and entry[1] != group):
+                return None
+            return self._board(group).index((-entry[0], qq)) + 1
+
+    def top(self, count: int, group: Optional[str] = None, start: int = 0) -> List[Tuple[str, int]]:
+        """从第 start+1 名开始的 count 个玩家 (QQ号, 哈哈币)，group 为 None 时为全服排行"""
+        with self._lock:
+            board = self._board(group)
+            if board is None:
+                return []
+            return [(qq, -neg_gold) for neg_gold, qq in board.slice(start, count)]
+
+    def size(self, group: Optional[str] = None) -> int:
+        """榜上人数"""
+        with self._lock:
+            board = self._board(group)
+            return len(board) if board is not None else 0
+
+    def __contains__(self, qq: str) -> bool:
+        with self._lock:
+            return qq in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,55 @@
+import inspect
+import threading
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, List, TypeVar
+
+F = TypeVar("F", bound=Callable)
+
+
+class UserLocks:
+    """
+    按QQ号分段的用户锁：QQ号哈希到固定数量的可重入锁上，内存占用不随用户数增长
+
+    同时锁定多个用户时按锁的下标顺序加锁，任意两个操作的加锁顺序一致，不会互相死锁；
+    不同用户可能落在同一把锁上，只会降低并发度，不影响正确性
+    """
+
+    def __init__(self, stripes: int = 64):
+        self._locks: List[threading.RLock] = [threading.RLock() for _ in range(stripes)]
+
+    def _index(self, qq: str) -> int:
+        # 不使用 hash()：字符串哈希每个进程随机，crc32 便于排查问题时复现
+        return zlib.crc32(qq.encode("utf-8")) % len(self._locks)
+
+    @contextmanager
+    def hold(self, *qqs: str) -> Iterator[None]:
+        """锁定一个或多个用户，退出时按相反顺序释放"""
+        indexes = sorted({self._index(qq) for qq in qqs})
+        acquired = []
+        try:
+            for index in indexes:
+                self._locks[index].acquire()
+                acquired.append(index)
+            yield
+        finally:
+            for index in reversed(acquired):
+                self._locks[index].release()
+
+    def locked(self, user_args: int = 1) -> Callable[[F], F]:
+        """
+        装饰器：调用前锁定前 user_args 个参数对应的用户（参数需为QQ号）。
+        参数按函数签名绑定，以关键字方式传入的QQ号同样会被锁定
+        """
+        def decorator(fn: F) -> F:
+            signature = inspect.signature(fn)
+            names = list(signature.parameters)[:user_args]
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                with self.hold(*(bound.arguments[name] for name in names if name in bound.arguments)):
+                    return fn(*args, **kwargs)
+            return wrapper  # type: ignore[return-value]
+        return decorator
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 一条待发送的通知：(用户QQ号, 通知内容)
+Notice = Tuple[str, str]
+
+
+class GroupNotifier:
+    """
+    群通知合并器：同一群在 window 秒内产生的通知合并成一条消息发送。
+    通知可以在任意线程中加入，统一转交给 start 时绑定的事件循环处理
+    """
+
+    def __init__(self, send: Callable[[str, List[Notice]], Awaitable[None]], window: float = 2.0):
+        """
+        初始化通知合并器
+
+        参数:
+        - send: 实际发送消息的协程函数，接收群号和该群的全部待发送通知
+        - window: 合并窗口（秒），窗口内的通知会一起发送
+        """
+        self.send = send
+        self.window = window
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, List[Notice]] = {}  # 只在事件循环线程中访问
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """绑定发送通知的事件循环，默认为当前正在运行的循环（在驱动启动时调用）"""
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+
+    def add(self, group: str, qq: str, text: str) -> None:
+        """加入一条通知，可在任意线程中调用；尚未 start 或循环已关闭时丢弃并记录警告"""
+        if self._loop is None or self._loop.is_closed():
+            logger.warning("通知合并器未绑定事件循环，丢弃群 %s 的通知", group)
+            return
+        self._loop.call_soon_threadsafe(self._add, group, qq, text)
+
+    def _add(self, group: str, qq: str, text: str) -> None:
+        self._pending.setdefault(group, []).append((qq, text))
+        if group not in self._tasks:
+            self._tasks[group] = self._loop.create_task(self._flush_later(group))
+
+    def pending(self) -> int:
+        """尚未发送的通知数量"""
+        return sum(len(notices) for notices in self._pending.values())
+
+    async def _flush_later(self, group: str) -> None:
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._tasks.pop(group, None)
+            notices = self._pending.pop(group, [])
+        if not notices:
+            return
+        try:
+            await self.send(group, notices)
+        except Exception:
+            logger.exception("发送群 %s 的通知失败", group)
+
+    def cancel(self) -> None:
+        """取消所有尚未发送的通知"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._pending.clear()
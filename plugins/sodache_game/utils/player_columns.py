@@ -0,0 +1,137 @@
+import heapq
+import operator
+import threading
+from array import array
+from itertools import compress, repeat
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 镜像到列存储中的 User 数值字段
+COLUMN_FIELDS: Tuple[str, ...] = (
+    "gold", "attack", "defense", "speed", "luck", "search_time", "backpack_capacity", "status",
+    "user_bag_items_nums", "search_start_time", "retreat_start_time",
+    "attack_cooldown_end_time", "attack_protection_end_time",
+)
+
+# where 支持的比较运算
+_OPERATORS: Dict[str, Callable[[int, int], bool]] = {
+    "<": operator.lt, "<=": operator.le, "==": operator.eq,
+    "!=": operator.ne, ">=": operator.ge, ">": operator.gt,
+}
+
+
+class PlayerColumns:
+    """
+    玩家数值字段的列存储：每个字段一个 array('q')，QQ号 -> 行号 的索引定位玩家。
+    全服统计（总哈哈币、破产人数、属性分布、排行）直接在整列上用内置函数计算，
+    不需要加载或遍历 User 对象；删除玩家时把最后一行移到空出的位置，各列保持紧凑。
+    """
+
+    def __init__(self, fields: Sequence[str] = COLUMN_FIELDS):
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self._columns: Dict[str, array] = {name: array("q") for name in self.fields}
+        self._qqs: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def update(self, user) -> None:
+        """写入（或新增）一个用户的当前数值"""
+        self.set(user.qq, (int(getattr(user, name)) for name in self.fields))
+
+    def set(self, qq: str, values: Iterable[int]) -> None:
+        """按 fields 的顺序写入一行，用于从数据库批量载入"""
+        with self._lock:
+            row = self._rows.get(qq)
+            if row is None:
+                self._rows[qq] = len(self._qqs)
+                self._qqs.append(qq)
+                for name, value in zip(self.fields, values):
+                    self._columns[name].append(value)
+                return
+            for name, value in zip(self.fields, values):
+                self._columns[name][row] = value
+
+    def remove(self, qq: str) -> None:
+        """删除一个用户的行"""
+        with self._lock:
+            row = self._rows.pop(qq, None)
+            if row is None:
+                return
+            last_qq = self._qqs.pop()
+            for column in self._columns.values():
+                last_value = column.pop()
+                if last_qq != qq:
+                    column[row] = last_value
+            if last_qq != qq:
+                self._qqs[row] = last_qq
+                self._rows[last_qq] = row
+
+    def get(self, qq: str, name: str) -> Optional[int]:
+        """单个用户的字段值，用户不在列存储中时返回 None"""
+        with self._lock:
+            row = self._rows.get(qq)
+            return None if row is None else self._columns[name][row]
+
+    def column(self, name: str) -> array:
+        """整列数据的副本，下标与 qqs() 一致"""
+        with self._lock:
+            return array("q", self._columns[name])
+
+    def qqs(self) -> List[str]:
+        """按行号排列的QQ号"""
+        with self._lock:
+            return list(self._qqs)
+
+    def total(self, name: str) -> int:
+        """整列求和"""
+        with self._lock:
+            return sum(self._columns[name])
+
+    def stats(self, name: str) -> Tuple[int, int, int, float]:
+        """整列的 (人数, 最小值, 最大值, 平均值)，没有玩家时都为 0"""
+        with self._lock:
+            column = self._columns[name]
+            if not column:
+                return 0, 0, 0, 0.0
+            return len(column), min(column), max(column), sum(column) / len(column)
+
+    def _mask(self, name: str, op: str, value: int):
+        if op not in _OPERATORS:
+            raise ValueError(f"不支持的比较运算：{op}，可选：{' '.join(_OPERATORS)}")
+        return map(_OPERATORS[op], self._columns[name], repeat(value))
+
+    def count(self, name: str, op: str, value: int) -> int:
+        """满足 字段 op 值 的玩家人数，如 count("gold", "<", 0) 为破产人数"""
+        with self._lock:
+            return sum(self._mask(name, op, value))
+
+    def where(self, name: str, op: str, value: int) -> List[str]:
+        """满足 字段 op 值 的玩家QQ号"""
+        with self._lock:
+            return list(compress(self._qqs, self._mask(name, op, value)))
+
+    def top(self, name: str, k: int, largest: bool = True) -> List[Tuple[str, int]]:
+        """字段最大（largest=False 时最小）的 k 个玩家 (QQ号, 值)，按值排序"""
+        with self._lock:
+            column = self._columns[name]
+            select = heapq.nlargest if largest else heapq.nsmallest
+            rows = select(k, range(len(column)), key=column.__getitem__)
+            return [(self._qqs[row], column[row]) for row in rows]
+
+    def histogram(self, name: str, edges: Sequence[int]) -> List[int]:
+        """
+        按分界值统计人数：edges 为递增的分界值，返回 len(edges)+1 个区间的人数，
+        第 i 个区间为 [edges[i-1], edges[i])，首尾区间不设下限/上限
+        """
+        with self._lock:
+            column = self._columns[name]
+            counts = [sum(map(operator.lt, column, repeat(edge))) for edge in edges]
+            counts.append(len(column))
+            return [counts[0]] + [counts[i] - counts[i - 1] for i in range(1, len(counts))]
+
+    def __contains__(self, qq: str) -> bool:
+        with self._lock:
+            return qq in self._rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._qqs)
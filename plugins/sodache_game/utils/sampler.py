@@ -0,0 +1,76 @@
+import random
+from typing import Generic, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class AliasSampler(Generic[T]):
+    """按权重抽样的别名表（Vose 别名法）：构建 O(n)，每次抽样 O(1) 且不分配新列表"""
+
+    __slots__ = ("items", "_prob", "_alias")
+
+    def __init__(self, items: Sequence[T], weights: Sequence[float]):
+        """
+        构建别名表
+
+        参数:
+        - items: 候选对象
+        - weights: 与 items 一一对应的权重，权重不大于0的对象永远不会被抽中
+        """
+        if len(items) != len(weights):
+            raise ValueError("items 和 weights 的长度必须一致")
+        pairs = [(item, float(weight)) for item, weight in zip(items, weights) if weight > 0]
+        self.items: List[T] = [item for item, _ in pairs]
+        n = len(pairs)
+        self._prob: List[float] = [1.0] * n
+        self._alias: List[int] = list(range(n))
+        if n == 0:
+            return
+
+        total = sum(weight for _, weight in pairs)
+        scaled = [weight * n / total for _, weight in pairs]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余的概率因浮点误差应接近1，直接视为1
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __bool__(self) -> bool:
+        return bool(self.items)
+
+    def sample(self) -> T:
+        """按权重随机抽取一个对象；没有可抽取的对象时抛出 IndexError"""
+        if not self.items:
+            raise IndexError("没有可抽取的对象")
+        r = random.random() * len(self.items)
+        i = int(r)
+        # 用同一个随机数的小数部分决定取本格还是别名，省去第二次调用 random
+        if r - i < self._prob[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+    def sample_many(self, k: int) -> List[T]:
+        """有放回地一次抽取 k 个对象（相当于一次多项分布抽样）"""
+        if k <= 0:
+            return []
+        if not self.items:
+            raise IndexError("没有可抽取的对象")
+        items, prob, alias = self.items, self._prob, self._alias
+        n = len(items)
+        rand = random.random
+        result = []
+        for _ in range(k):
+            r = rand() * n
+            i = int(r)
+            result.append(items[i] if r - i < prob[i] else items[alias[i]])
+        return result
@@ -0,0 +1,73 @@
+import heapq
+import threading
+from itertools import count
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# 事件键：(用户QQ号, 事件类型)
+EventKey = Tuple[str, str]
+
+
+class EventScheduler:
+    """
+    定时事件堆：每个 (用户, 事件类型) 最多保留一个待触发事件
+
+    重新安排或取消事件时不从堆中删除旧条目，只让它失效，弹出时跳过；
+    因此安排和弹出都是 O(log n)，每次处理只需要触及到期的事件
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, EventKey]] = []
+        self._due: Dict[EventKey, Tuple[float, int]] = {}  # 有效事件的 (触发时间, 序号)
+        self._seq = count()
+        self._lock = threading.Lock()
+
+    def schedule(self, qq: str, kind: Hashable, due: float) -> None:
+        """安排事件在 due 时刻触发，替换该用户同类型的已有事件"""
+        key = (qq, kind)
+        with self._lock:
+            current = self._due.get(key)
+            if current is not None and current[0] == due:
+                return
+            seq = next(self._seq)
+            self._due[key] = (due, seq)
+            heapq.heappush(self._heap, (due, seq, key))
+            # 失效条目过多时重建堆，避免频繁重新安排导致堆无限增长
+            if len(self._heap) > 2 * len(self._due) + 64:
+                self._heap = [(d, s, k) for k, (d, s) in self._due.items()]
+                heapq.heapify(self._heap)
+
+    def cancel(self, qq: str, kind: Hashable) -> None:
+        """取消用户的某类事件（不存在时无副作用）"""
+        with self._lock:
+            self._due.pop((qq, kind), None)
+
+    def get(self, qq: str, kind: Hashable) -> Optional[float]:
+        """用户某类事件的触发时间，没有安排时返回 None"""
+        with self._lock:
+            current = self._due.get((qq, kind))
+        return current[0] if current is not None else None
+
+    def next_due(self) -> Optional[float]:
+        """最早的有效事件的触发时间，没有事件时返回 None"""
+        with self._lock:
+            while self._heap:
+                due, seq, key = self._heap[0]
+                if self._due.get(key) == (due, seq):
+                    return due
+                heapq.heappop(self._heap)
+            return None
+
+    def pop_due(self, now: float) -> List[EventKey]:
+        """弹出所有在 now 之前（含）到期的事件，按触发时间排序"""
+        due_events = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, seq, key = heapq.heappop(self._heap)
+                if self._due.get(key) == (due, seq):
+                    del self._due[key]
+                    due_events.append(key)
+        return due_events
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._due)
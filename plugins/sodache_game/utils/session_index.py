@@ -0,0 +1,69 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+
+class SessionIndex:
+    """活跃会话索引：按状态和搜索所在群维护正在搜索或撤离的用户，空闲用户不入索引"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[int, str]] = {}  # qq -> (状态, 搜索所在群)
+        self._by_status: Dict[int, Set[str]] = defaultdict(set)
+        self._by_group: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.RLock()
+
+    def update(self, qq: str, status: int, group: str) -> None:
+        """同步一个用户的状态，状态为0（空闲）时从索引中移除"""
+        with self._lock:
+            if self._sessions.get(qq) == (status, group):
+                return
+            self.remove(qq)
+            if status == 0:
+                return
+            self._sessions[qq] = (status, group)
+            self._by_status[status].add(qq)
+            self._by_group[group].add(qq)
+
+    def remove(self, qq: str) -> None:
+        """从索引中移除用户"""
+        with self._lock:
+            session = self._sessions.pop(qq, None)
+            if session is None:
+                return
+            status, group = session
+            self._discard(self._by_status, status, qq)
+            self._discard(self._by_group, group, qq)
+
+    @staticmethod
+    def _discard(index: dict, key, qq: str) -> None:
+        members = index.get(key)
+        if members is not None:
+            members.discard(qq)
+            if not members:
+                del index[key]
+
+    def get(self, qq: str) -> Optional[Tuple[int, str]]:
+        """返回用户的 (状态, 搜索所在群)，不在活跃会话中时返回 None"""
+        with self._lock:
+            return self._sessions.get(qq)
+
+    def with_status(self, status: int) -> Set[str]:
+        """处于指定状态的所有用户"""
+        with self._lock:
+            return set(self._by_status.get(status, ()))
+
+    def in_group(self, group: str, status: Optional[int] = None) -> Set[str]:
+        """在指定群中搜索或撤离的用户，可按状态过滤"""
+        with self._lock:
+            members = self._by_group.get(group, ())
+            if status is None:
+                return set(members)
+            return {qq for qq in members if self._sessions[qq][0] == status}
+
+    def __contains__(self, qq: str) -> bool:
+        with self._lock:
+            return qq in self._sessions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
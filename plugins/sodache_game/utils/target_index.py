@@ -0,0 +1,74 @@
+import heapq
+import threading
+from typing import Dict, List, Set, Tuple
+
+
+class TargetIndex:
+    """
+    可攻击目标索引：按群维护正在搜索或撤离、且不在被攻击保护中的玩家。
+    处于保护中的玩家放在按保护结束时间排序的小顶堆中，查询时只弹出已到期的部分移回可攻击集合，
+    不需要遍历所有玩家；堆中过期的记录（玩家状态已变化）弹出时直接丢弃
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, int]] = {}  # qq -> (搜索所在群, 保护结束时间)，只含搜索或撤离中的玩家
+        self._attackable: Dict[str, Set[str]] = {}      # 群 -> 当前可攻击的玩家
+        self._protected: List[Tuple[int, str]] = []     # (保护结束时间, qq)
+        self._lock = threading.RLock()
+
+    def update(self, qq: str, status: int, group: str, protection_end: int, now: float) -> None:
+        """同步一个玩家的状态、所在群和保护结束时间，状态为0（空闲）时从索引中移除"""
+        with self._lock:
+            if status == 0:
+                self.remove(qq)
+                return
+            # 顺便处理已到期的保护，避免过期记录一直留在堆中直到有人查询
+            self.expire(now)
+            entry = (group, protection_end)
+            if self._entries.get(qq) == entry:
+                return
+            self.remove(qq)
+            self._entries[qq] = entry
+            if protection_end > now:
+                heapq.heappush(self._protected, (protection_end, qq))
+                # 保护被刷新或玩家离开后旧记录仍在堆中，失效记录过多时按当前索引重建
+                if len(self._protected) > 2 * len(self._entries) + 64:
+                    self._protected = [(end, member) for member, (_, end) in self._entries.items() if end > now]
+                    heapq.heapify(self._protected)
+            else:
+                self._attackable.setdefault(group, set()).add(qq)
+
+    def remove(self, qq: str) -> None:
+        """从索引中移除玩家（仍在堆中的记录会在到期时被丢弃）"""
+        with self._lock:
+            entry = self._entries.pop(qq, None)
+            if entry is None:
+                return
+            members = self._attackable.get(entry[0])
+            if members is not None:
+                members.discard(qq)
+                if not members:
+                    del self._attackable[entry[0]]
+
+    def expire(self, now: float) -> None:
+        """把保护已经结束的玩家移入可攻击集合"""
+        with self._lock:
+            while self._protected and self._protected[0][0] <= now:
+                protection_end, qq = heapq.heappop(self._protected)
+                entry = self._entries.get(qq)
+                if entry is not None and entry[1] == protection_end:
+                    self._attackable.setdefault(entry[0], set()).add(qq)
+
+    def attackable(self, group: str, now: float) -> Set[str]:
+        """指定群中当前可以被攻击的玩家"""
+        with self._lock:
+            self.expire(now)
+            return set(self._attackable.get(group, ()))
+
+    def __contains__(self, qq: str) -> bool:
+        with self._lock:
+            return qq in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional
+from ..models.game_models import User
+
+# 粗略估算的内存占用（字节）：用户对象本身，以及每件物品/装备
+USER_BASE_BYTES = 2048
+ENTRY_BYTES = 400
+
+
+def estimate_user_bytes(user: User) -> int:
+    """估算一个用户（含背包、装备和装备仓库）占用的内存"""
+    entries = len(user.inventory) + len(user.equipment) + len(user.equipment_storage)
+    return USER_BASE_BYTES + entries * ENTRY_BYTES
+
+
+class _Entry:
+    __slots__ = ("user", "size", "last_access")
+
+    def __init__(self, user: User, size: int, last_access: float):
+        self.user = user
+        self.size = size
+        self.last_access = last_access
+
+
+class UserCache:
+    """按需加载用户的 LRU 缓存：首次访问时从数据库加载，超出容量或内存预算时淘汰最久未访问的用户"""
+
+    def __init__(self, loader: Callable[[str], Optional[User]], max_users: int = 10000,
+                 memory_budget: int = 64 * 1024 * 1024, min_idle: float = 600,
+                 can_evict: Optional[Callable[[User], bool]] = None):
+        """
+        初始化用户缓存
+
+        参数:
+        - loader: 根据QQ号从数据库加载用户的函数，用户不存在时返回 None
+        - max_users: 最多缓存的用户数
+        - memory_budget: 缓存的估算内存上限（字节）
+        - min_idle: 用户至少空闲多久（秒）才允许被淘汰，避免淘汰正在交互中的用户
+        - can_evict: 判断用户能否淘汰，返回 False 时暂时保留（如还有尚未写入的修改），等以后再淘汰
+        """
+        self.loader = loader
+        self.max_users = max_users
+        self.memory_budget = memory_budget
+        self.min_idle = min_idle
+        self.can_evict = can_evict
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, qq: str) -> Optional[User]:
+        """获取用户，不在缓存中时从数据库加载；数据库中也没有则返回 None"""
+        user = self.peek(qq)
+        if user is not None:
+            return user
+        loaded = self.loader(qq)
+        if loaded is None:
+            return None
+        return self.setdefault(qq, loaded)
+
+    def peek(self, qq: str) -> Optional[User]:
+        """只在缓存中查找用户，命中时刷新访问顺序，不会访问数据库"""
+        with self._lock:
+            entry = self._entries.get(qq)
+            if entry is None:
+                return None
+            self._entries.move_to_end(qq)
+            entry.last_access = time.monotonic()
+            # 用户可能在上次访问后增减了物品，顺便刷新估算大小
+            size = estimate_user_bytes(entry.user)
+            self._total_bytes += size - entry.size
+            entry.size = size
+            return entry.user
+
+    def setdefault(self, qq: str, user: User) -> User:
+        """缓存中已有该用户时返回已有对象，否则放入缓存并返回 user"""
+        with self._lock:
+            existing = self.peek(qq)
+            if existing is not None:
+                return existing
+            self._put(qq, user)
+            return user
+
+    def __getitem__(self, qq: str) -> User:
+        user = self.get(qq)
+        if user is None:
+            raise KeyError(qq)
+        return user
+
+    def __setitem__(self, qq: str, user: User) -> None:
+        with self._lock:
+            self._remove(qq)
+            self._put(qq, user)
+
+    def __contains__(self, qq: str) -> bool:
+        with self._lock:
+            return qq in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def keys(self) -> List[str]:
+        """当前缓存中的QQ号（不包含未加载的用户）"""
+        with self._lock:
+            return list(self._entries)
+
+    def values(self) -> List[User]:
+        """当前缓存中的用户（不包含未加载的用户）"""
+        with self._lock:
+            return [entry.user for entry in self._entries.values()]
+
+    def pop(self, qq: str, default=None) -> Optional[User]:
+        """从缓存中移除用户（不会写入数据库）"""
+        with self._lock:
+            entry = self._remove(qq)
+            return entry.user if entry is not None else default
+
+    @property
+    def memory_usage(self) -> int:
+        """缓存的估算内存占用（字节）"""
+        with self._lock:
+            return self._total_bytes
+
+    def _put(self, qq: str, user: User) -> None:
+        size = estimate_user_bytes(user)
+        self._entries[qq] = _Entry(user, size, time.monotonic())
+        self._total_bytes += size
+        self._evict()
+
+    def _remove(self, qq: str) -> Optional[_Entry]:
+        entry = self._entries.pop(qq, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+        return entry
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        excess_users = len(self._entries) - self.max_users
+        excess_bytes = self._total_bytes - self.memory_budget
+        victims = []
+        # 从最久未访问的用户开始挑选，不能淘汰的用户跳过（留在原位置，下次再判断）
+        for qq, entry in self._entries.items():
+            if excess_users <= 0 and excess_bytes <= 0:
+                break
+            # 还没空闲够久，说明之后的都是活跃用户，已超出预算也暂不淘汰
+            if now - entry.last_access < self.min_idle:
+                break
+            if self.can_evict is not None and not self.can_evict(entry.user):
+                continue
+            victims.append(qq)
+            excess_users -= 1
+            excess_bytes -= entry.size
+        for qq in victims:
+            self._remove(qq)
@@ -0,0 +1,101 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set
+from ..models.game_models import User
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """延迟写回队列：合并同一用户的多次修改，由后台线程批量写入数据库"""
+
+    def __init__(self, flush_fn: Callable[[List[Any]], None], interval: float = 3.0, threshold: int = 50,
+                 snapshot: Optional[Callable[[User], Any]] = None):
+        """
+        初始化写回队列
+
+        参数:
+        - flush_fn: 批量写入函数，接收脏用户列表（提供 snapshot 时为快照列表），需在一个事务内完成写入
+        - interval: 后台刷新间隔（秒），默认3
+        - threshold: 脏用户数量达到该值时立即唤醒刷新，默认50
+        - snapshot: 复制用户数据的函数，刷新时对每个脏用户调用一次，写入复制出的数据而不是仍在被修改的用户对象
+        """
+        self.flush_fn = flush_fn
+        self.snapshot = snapshot
+        self.interval = interval
+        self.threshold = threshold
+        self._dirty: Dict[str, User] = {}
+        self._writing: Set[str] = set()      # 已取出、正在写入的用户
+        self._lock = threading.Lock()        # 保护 _dirty 和 _writing
+        self._flush_lock = threading.Lock()  # 保证同一时间只有一个刷新在执行
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_dirty(self, user: User) -> None:
+        """标记用户数据已修改，等待下一次刷新写入"""
+        with self._lock:
+            self._dirty[user.qq] = user
+            dirty_count = len(self._dirty)
+        if dirty_count >= self.threshold:
+            self._wakeup.set()
+
+    def is_dirty(self, qq: str) -> bool:
+        """用户是否有尚未写入（包括正在写入、尚未提交）的修改"""
+        with self._lock:
+            return qq in self._dirty or qq in self._writing
+
+    def pending(self) -> int:
+        """当前等待写入的用户数量"""
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self) -> int:
+        """同步写入所有脏用户，返回写入的用户数量"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._dirty.values())
+                self._dirty.clear()
+                self._writing.update(user.qq for user in batch)
+            if not batch:
+                return 0
+            try:
+                self.flush_fn(batch if self.snapshot is None else [self.snapshot(user) for user in batch])
+            except Exception:
+                # 写入失败时放回队列等待重试，期间重新标记的用户保持不变
+                with self._lock:
+                    for user in batch:
+                        self._dirty.setdefault(user.qq, user)
+                raise
+            finally:
+                with self._lock:
+                    self._writing.clear()
+            return len(batch)
+
+    def start(self) -> None:
+        """启动后台刷新线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sodache-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台线程，并同步写入剩余的脏用户"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("写回用户数据失败，将在下次刷新时重试")